@@ -0,0 +1,278 @@
+"""
+Benchmarks insight's hot paths: the click view and the registration tracked
+when a visitor logs in.
+
+Each run sets up a fresh SQLite database with `--origins` origins that track
+`--params` querystring parameters each, then clicks and logs in `--requests`
+times from `--concurrency` threads, and reports latency percentiles,
+throughput and queries per operation. Use `--json` to get a line that can be
+kept and compared across commits, e.g.::
+
+    python benchmarks/hotpaths.py --origins 1000 --params 5 --json
+
+Run with Django on the path.
+"""
+import json
+import optparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+SESSION_BACKENDS = ('db', 'cache', 'signed_cookies', 'cookie')
+
+
+def parse_args():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option('--origins', type='int', default=100,
+                      help='The number of origins. [%default]')
+    parser.add_option('--params', type='int', default=3,
+                      help='Tracked querystring parameters per origin. '
+                           '[%default]')
+    parser.add_option('--requests', type='int', default=1000,
+                      help='Clicks and logins per run. [%default]')
+    parser.add_option('--concurrency', type='int', default=1,
+                      help='The number of threads. [%default]')
+    parser.add_option('--session-backend', choices=SESSION_BACKENDS,
+                      default='db',
+                      help='One of %s, where cookie means insight\'s signed '
+                           'cookie storage. [%%default]'
+                           % ', '.join(SESSION_BACKENDS))
+    parser.add_option('--json', action='store_true', default=False,
+                      help='Print the results as one JSON line.')
+    return parser.parse_args()[0]
+
+
+def configure(options, path):
+    from django.conf import settings
+
+    if options.session_backend == 'cookie':
+        session_engine = 'django.contrib.sessions.backends.db'
+        storage = 'cookie'
+    else:
+        session_engine = 'django.contrib.sessions.backends.%s' \
+            % options.session_backend
+        storage = 'session'
+    settings.configure(
+        DEBUG=False,
+        SECRET_KEY='benchmark',
+        ALLOWED_HOSTS=['*'],
+        DATABASES={'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': path,
+            'OPTIONS': {'timeout': 60},
+        }},
+        CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        INSTALLED_APPS=(
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'django.contrib.sessions',
+            'django.contrib.sites',
+            'insight',
+        ),
+        MIDDLEWARE_CLASSES=(
+            'django.contrib.sessions.middleware.SessionMiddleware',
+            'django.contrib.auth.middleware.AuthenticationMiddleware',
+            'insight.middleware.TrackingCookieMiddleware',
+        ),
+        ROOT_URLCONF='insight.urls',
+        SESSION_ENGINE=session_engine,
+        INSIGHT_STORAGE=storage,
+    )
+
+
+def setup_data(options):
+    from django.core.management import call_command
+    from insight.models import Origin, User
+
+    call_command('syncdb', interactive=False, verbosity=0)
+    params = "\n".join('p%d' % i for i in range(options.params))
+    Origin.objects.bulk_create_origins([
+        Origin(title='origin %d' % i, querystring_parameters=params)
+        for i in range(options.origins)
+    ])
+    User.objects.bulk_create([
+        User(username='user%d' % i, password='!')
+        for i in range(options.requests)
+    ])
+    return (list(Origin.objects.values_list('code', flat=True)),
+            list(User.objects.order_by('pk')))
+
+
+def query_string(options):
+    # a realistic mix of tracked and untracked parameters
+    query = dict(('p%d' % i, str(random.randint(0, 50)))
+                 for i in range(options.params))
+    query.update(utm_source='newsletter', utm_campaign='x' * 40)
+    return query
+
+
+class Operation(object):
+    """
+    Runs an operation `options.requests` times from `options.concurrency`
+    threads. Subclasses are called with the index of each run to perform
+    it.
+    """
+    name = None
+
+    def __init__(self, options, codes, users):
+        self.options = options
+        self.codes = codes
+        self.users = users
+        self.latencies = []
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def run(self):
+        from django.db import connection
+
+        indexes = iter(range(self.options.requests))
+
+        def worker():
+            connection.use_debug_cursor = True
+            while True:
+                with self.lock:
+                    try:
+                        i = next(indexes)
+                    except StopIteration:
+                        break
+                del connection.queries[:]
+                start = time.time()
+                self(i)
+                elapsed = time.time() - start
+                with self.lock:
+                    self.latencies.append(elapsed)
+                    self.queries.append(len(connection.queries))
+            connection.close()
+
+        threads = [threading.Thread(target=worker)
+                   for i in range(self.options.concurrency)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.report(time.time() - start)
+
+    def report(self, elapsed):
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1,
+                                 int(len(latencies) * p / 100.0))] * 1000
+
+        return {
+            'operation': self.name,
+            'p50_ms': round(percentile(50), 3),
+            'p95_ms': round(percentile(95), 3),
+            'p99_ms': round(percentile(99), 3),
+            'ops_per_second': round(len(latencies) / elapsed, 1),
+            'queries_per_op': round(
+                float(sum(self.queries)) / len(self.queries), 2),
+        }
+
+
+class Click(Operation):
+    name = 'click'
+
+    def __call__(self, i):
+        from django.test.client import Client
+
+        # every click is a new visitor
+        Client().get('/i/%s/' % random.choice(self.codes),
+                     query_string(self.options))
+
+
+class Login(Operation):
+    name = 'login'
+
+    def __init__(self, *args, **kwargs):
+        from django.http import HttpRequest, HttpResponse
+        from django.utils.importlib import import_module
+        from django.conf import settings
+        from insight.models import Origin
+        from insight.storage import get_storage, filter_params
+
+        super(Login, self).__init__(*args, **kwargs)
+        # the click each login follows is stored up front
+        engine = import_module(settings.SESSION_ENGINE)
+        storage = get_storage()
+        origins = dict((o.code, o) for o in Origin.objects.all())
+        self.requests = []
+        for i in range(self.options.requests):
+            request = HttpRequest()
+            request.session = engine.SessionStore()
+            response = HttpResponse()
+            origin = origins[random.choice(self.codes)]
+            storage.save(request, response, origin.code, filter_params(
+                query_string(self.options), origin.parameter_list))
+            for name, cookie in response.cookies.items():
+                request.COOKIES[name] = cookie.value
+            self.requests.append(request)
+
+    def __call__(self, i):
+        from django.contrib.auth.signals import user_logged_in
+
+        user = self.users[i]
+        user_logged_in.send(sender=user.__class__, request=self.requests[i],
+                            user=user)
+
+
+def commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    options = parse_args()
+    directory = tempfile.mkdtemp()
+    try:
+        configure(options, os.path.join(directory, 'benchmark.db'))
+        codes, users = setup_data(options)
+        results = [operation(options, codes, users).run()
+                   for operation in (Click, Login)]
+        # the hits still buffered are written while the database exists,
+        # rather than by the exit handler
+        from insight.hits import hit_counter
+        hit_counter.flush()
+    finally:
+        shutil.rmtree(directory)
+
+    run = {
+        'commit': commit(),
+        'origins': options.origins,
+        'params': options.params,
+        'requests': options.requests,
+        'concurrency': options.concurrency,
+        'session_backend': options.session_backend,
+        'results': results,
+    }
+    if options.json:
+        print(json.dumps(run, sort_keys=True))
+        return
+    print("commit %(commit)s, %(origins)d origins, %(params)d params, "
+          "%(requests)d requests, concurrency %(concurrency)d, "
+          "%(session_backend)s sessions" % run)
+    print("%-10s %10s %10s %10s %12s %10s" % (
+        'operation', 'p50 ms', 'p95 ms', 'p99 ms', 'ops/s', 'queries'))
+    for result in results:
+        print("%(operation)-10s %(p50_ms)10.3f %(p95_ms)10.3f "
+              "%(p99_ms)10.3f %(ops_per_second)12.1f %(queries_per_op)10.2f"
+              % result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Compares the session payload of storing a click's whole query string with
+storing only its tracked parameters, for each session backend's encoding.
+
+Run with `python benchmarks/session_payload.py` with Django on the path.
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from django.conf import settings
+
+settings.configure(
+    SECRET_KEY='benchmark',
+    INSTALLED_APPS=('django.contrib.sessions',),
+    CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    SESSION_SERIALIZER='django.contrib.sessions.serializers.PickleSerializer',
+)
+
+from django.http import QueryDict
+from django.utils.importlib import import_module
+
+from insight.storage import filter_params
+
+
+BACKENDS = (
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cache',
+    'django.contrib.sessions.backends.signed_cookies',
+)
+NUMBER = 2000
+
+QUERY = QueryDict('&'.join([
+    'pid=123456',
+    'oid=affiliate-42',
+    'utm_source=newsletter-2014-09-weekly-digest-subscribers-segment-b',
+    'utm_medium=email',
+    'utm_campaign=spring-sale-final-reminder-with-extra-long-identifier',
+    'utm_content=' + 'x' * 300,
+    'fbclid=' + 'IwAR' + 'a1b2c3d4' * 12,
+    'gclid=' + 'Cj0KCQjw' + 'z9y8x7w6' * 10,
+] + ['junk%d=%d' % (i, i) for i in range(20)]))
+
+
+def measure(backend, params):
+    engine = import_module(backend)
+    store = engine.SessionStore()
+    data = {'insight_code': 'abc1234', 'insight_params': params}
+    if backend.endswith('signed_cookies'):
+        store.update(data)
+        encode = lambda: store._get_session_key()
+    else:
+        encode = lambda: store.encode(data)
+    size = len(encode())
+    seconds = timeit.timeit(encode, number=NUMBER) / NUMBER
+    return size, seconds * 1e6
+
+
+def main():
+    tracked = filter_params(QUERY, ['pid', 'oid', 'utm_campaign'])
+    print("%-48s %18s %18s" % ('backend', 'query string', 'tracked only'))
+    for backend in BACKENDS:
+        full = measure(backend, QUERY)
+        compact = measure(backend, tracked)
+        print("%-48s %7d B %6.1f us %7d B %6.1f us"
+              % ((backend,) + full + compact))
+
+
+if __name__ == '__main__':
+    main()
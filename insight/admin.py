@@ -1,23 +1,237 @@
+import copy
+import datetime
+import json
+import threading
+
+from django.conf.urls import patterns, url
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
 from django.contrib.sites.models import Site
+from django.core.urlresolvers import reverse
+from django.http import (Http404, HttpResponse, HttpResponseRedirect,
+                         QueryDict)
+from django.shortcuts import render
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:  # django < 1.5
+    from django.http import HttpResponse as StreamingHttpResponse
+
+from insight.models import (Origin, OriginGroup, QuerystringParameter,
+                            with_registrations_total)
+from insight.export import export_lines
+from insight.funnel import origin_funnel
+from insight.routers import reporting
+from insight.stats import get_stats
+
+
+STATS_WINDOWS = (1, 7, 30, 90)
+FUNNEL_MAX_LIMIT = 100
+
+
+def export_redirect(kind, request, origins):
+    # StreamingHttpResponse can't be returned from an action on django 1.5
+    query = QueryDict('', mutable=True)
+    query['kind'] = kind
+    if request.POST.get('select_across') == '1':
+        # the origins of all pages may not fit in a url, so the export view
+        # filters them like the changelist instead
+        query['changelist'] = request.GET.urlencode()
+    else:
+        query.setlist('origin', [origin.pk for origin in origins])
+    return HttpResponseRedirect('%s?%s' % (
+        reverse('admin:insight_origin_export'), query.urlencode()))
+
+
+def export_registrations(modeladmin, request, queryset):
+    return export_redirect('registrations', request, queryset)
+export_registrations.short_description = \
+    "Export registrations of selected origins"
+
+
+def export_parameters(modeladmin, request, queryset):
+    return export_redirect('parameters', request, queryset)
+export_parameters.short_description = \
+    "Export querystring parameters of selected origins"
+
+
+class RegistrationCountMixin(object):
 
-from insight.models import Origin, OriginGroup, QuerystringParameter
+    def queryset(self, request):
+        queryset = super(RegistrationCountMixin, self).queryset(request)
+        if getattr(request, 'insight_reporting', False):
+            queryset = reporting(queryset)
+        # the total includes the shards, and can be sorted on
+        return with_registrations_total(queryset)
 
+    def changelist_view(self, request, extra_context=None):
+        # listing reads from the reporting database, while actions on the
+        # listed objects are posted and stay on the primary
+        request.insight_reporting = request.method == 'GET'
+        return super(RegistrationCountMixin, self).changelist_view(
+            request, extra_context)
 
-class OriginAdmin(admin.ModelAdmin):
+    def total_registrations(self, obj):
+        return obj.registrations_total
+    total_registrations.short_description = 'number of registrations'
+    total_registrations.admin_order_field = 'registrations_total'
+
+
+class OriginAdmin(RegistrationCountMixin, admin.ModelAdmin):
     list_display = ('title', 'description', 'origin_group',
-                    'url', 'number_of_registrations')
+                    'url', 'total_registrations', 'number_of_hits', 'funnel')
+    list_filter = ('origin_group', 'track_registrations')
+    search_fields = ('=code', '^title')
+    actions = [export_registrations, export_parameters]
+
+    def __init__(self, *args, **kwargs):
+        super(OriginAdmin, self).__init__(*args, **kwargs)
+        # holds the site domain while a changelist is rendered
+        self._local = threading.local()
+
+    def queryset(self, request):
+        # list_select_related doesn't follow nullable foreign keys
+        return super(OriginAdmin, self).queryset(request) \
+            .select_related('origin_group')
+
+    def changelist_view(self, request, extra_context=None):
+        self._local.domain = Site.objects.get_current().domain
+        try:
+            return super(OriginAdmin, self).changelist_view(
+                request, extra_context)
+        finally:
+            del self._local.domain
 
     def url(self, origin):
-        url = "%s%s" % (Site.objects.get_current().domain,
-                        origin.get_absolute_url())
+        domain = getattr(self._local, 'domain', None)
+        if domain is None:
+            domain = Site.objects.get_current().domain
+        url = "%s%s" % (domain, origin.get_absolute_url())
         return '<a href="//%s">%s</a>' % (url, url)
     url.allow_tags = True
 
+    def funnel(self, origin):
+        return '<a href="%s">Funnel</a>' % reverse(
+            'admin:insight_origin_funnel', args=(origin.pk,))
+    funnel.allow_tags = True
+
+    def get_urls(self):
+        return patterns(
+            '',
+            url(
+                r'^stats/$',
+                self.admin_site.admin_view(self.stats_view),
+                name='insight_origin_stats'
+            ),
+            url(
+                r'^export/$',
+                self.admin_site.admin_view(self.export_view),
+                name='insight_origin_export'
+            ),
+            url(
+                r'^(\d+)/funnel/$',
+                self.admin_site.admin_view(self.funnel_view),
+                name='insight_origin_funnel'
+            ),
+        ) + super(OriginAdmin, self).get_urls()
+
+    def stats_view(self, request):
+        try:
+            days = int(request.GET.get('days', 30))
+        except ValueError:
+            days = 30
+        if days not in STATS_WINDOWS:
+            days = 30
+        return render(request, 'admin/insight/origin/stats.html', {
+            'title': 'Origin stats',
+            'opts': self.model._meta,
+            'app_label': self.model._meta.app_label,
+            'windows': STATS_WINDOWS,
+            'stats': get_stats(days),
+        })
+
+    def funnel_view(self, request, object_id):
+        """
+        Shows the conversion of an origin and its top querystring parameter
+        values, as JSON with ``format=json``.
+        """
+        try:
+            limit = max(1, min(int(request.GET.get('limit', 10)),
+                               FUNNEL_MAX_LIMIT))
+        except ValueError:
+            limit = 10
+        try:
+            funnel = origin_funnel(int(object_id), limit,
+                                   request.GET.get('identifier') or None)
+        except Origin.DoesNotExist:
+            raise Http404
+        if request.GET.get('format') == 'json':
+            return HttpResponse(json.dumps(funnel),
+                                content_type='application/json')
+        return render(request, 'admin/insight/origin/funnel.html', {
+            'title': 'Funnel of %s' % funnel['origin']['title'],
+            'opts': self.model._meta,
+            'app_label': self.model._meta.app_label,
+            'funnel': funnel,
+            'limit': limit,
+        })
+
+    def changelist_origins(self, request, query):
+        """
+        Returns a queryset of the pks of the origins the changelist lists
+        for the query string `query`, on all pages, to filter by as a
+        subquery.
+        """
+        changelist_request = copy.copy(request)
+        changelist_request.GET = QueryDict(query)
+        # the export reads the reporting database, and a subquery has to
+        # read the same one
+        changelist_request.insight_reporting = True
+        ChangeList = self.get_changelist(changelist_request)
+        cl = ChangeList(changelist_request, self.model, self.list_display,
+                        self.list_display_links, self.list_filter,
+                        self.date_hierarchy, self.search_fields,
+                        self.list_select_related, self.list_per_page,
+                        self.list_max_show_all, self.list_editable, self)
+        return cl.get_query_set(changelist_request).order_by().values('pk')
+
+    def export_view(self, request):
+        """
+        Streams a CSV export of `kind` (registrations or parameters),
+        filtered by the `origin`, `group`, `since` and `until` parameters,
+        or by the `changelist` query string of the origin changelist.
+        """
+        kind = request.GET.get('kind')
+        if kind not in ('registrations', 'parameters'):
+            raise Http404
+        filters = {}
+        try:
+            if 'changelist' in request.GET:
+                filters['origins'] = self.changelist_origins(
+                    request, request.GET['changelist'])
+            if 'origin' in request.GET:
+                filters['origins'] = map(int, request.GET.getlist('origin'))
+            if 'group' in request.GET:
+                filters['group'] = int(request.GET['group'])
+            if kind == 'registrations':
+                for name in ('since', 'until'):
+                    if name in request.GET:
+                        filters[name] = datetime.datetime.strptime(
+                            request.GET[name], '%Y-%m-%d')
+        except (ValueError, IncorrectLookupParameters):
+            raise Http404
+        response = StreamingHttpResponse(export_lines(kind, **filters),
+                                         content_type='text/csv')
+        response['Content-Disposition'] = \
+            'attachment; filename="insight-%s.csv"' % kind
+        return response
+
 
-class QuerystringParameterAdmin(admin.ModelAdmin):
+class QuerystringParameterAdmin(RegistrationCountMixin, admin.ModelAdmin):
     list_display = ('origin', 'identifier', 'value',
-                    'number_of_registrations')
+                    'total_registrations', 'number_of_hits')
+    list_select_related = True
+    list_filter = ('identifier',)
+    search_fields = ('=origin__code', '^value')
 
 
 admin.site.register(Origin, OriginAdmin)
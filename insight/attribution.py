@@ -0,0 +1,89 @@
+"""
+Multi-touch attribution.
+
+With `INSIGHT_ATTRIBUTION` on, the storage keeps a list of the visitor's
+touches, [code, unix time] pairs of the origins they clicked, next to the
+last origin code. The first touch is always kept; a later click on an origin
+replaces its earlier touch, and only the latest `INSIGHT_MAX_TOUCHES` touches
+are kept besides the first.
+
+When a visitor registers, the touches younger than `INSIGHT_TOUCH_WINDOW`
+seconds are credited to their origins in `OriginAttribution`: the first
+touched origin gets a first-touch registration, the last one a last-touch
+registration, and every touched origin an equal share of a linear
+registration. The credits of a batch of registrations are written with one
+upsert, so reports read them without replaying any touches.
+"""
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+from insight.cache import resolve_origin
+from insight.sql import upsert_increment
+
+
+CREDITS = ('first_touch', 'last_touch', 'linear')
+
+
+def attribution_enabled():
+    return getattr(settings, 'INSIGHT_ATTRIBUTION', False)
+
+
+def add_touch(touches, code, now=None):
+    """
+    Returns `touches` with a touch of `code` at `now` added.
+    """
+    now = int(now if now is not None else time.time())
+    if not touches:
+        return [[code, now]]
+    first = list(touches[0])
+    rest = [list(t) for t in touches[1:] if t[0] != code]
+    if rest or first[0] != code:
+        rest.append([code, now])
+    max_touches = getattr(settings, 'INSIGHT_MAX_TOUCHES', 5)
+    if max_touches <= 1:
+        return [first]
+    return [first] + rest[-(max_touches - 1):]
+
+
+def credit(touches, now=None):
+    """
+    Returns the (first touch, last touch, linear) credit per origin of the
+    (origin, time) touches within the window.
+    """
+    now = now if now is not None else time.time()
+    window = getattr(settings, 'INSIGHT_TOUCH_WINDOW', 60 * 60 * 24 * 30)
+    origins = [origin for origin, at in touches if now - at <= window]
+    credits = {}
+    if not origins:
+        return credits
+    distinct = set(origins)
+    for origin in distinct:
+        credits[origin] = [0, 0, 1.0 / len(distinct)]
+    credits[origins[0]][0] = 1
+    credits[origins[-1]][1] = 1
+    return credits
+
+
+def record_attribution(touch_lists):
+    """
+    Adds the credits of each list of touches in `touch_lists`, one per
+    registration, to the attribution counters of the touched origins.
+    """
+    from insight.models import OriginAttribution
+    totals = defaultdict(lambda: [0, 0, 0.0])
+    for touches in touch_lists:
+        # touches of origins that no longer exist are dropped
+        known = []
+        for code, at in touches or ():
+            origin = resolve_origin(code)
+            if origin is not None:
+                known.append((origin['pk'], at))
+        for origin_pk, credits in credit(known).items():
+            for i, n in enumerate(credits):
+                totals[origin_pk][i] += n
+    if not totals:
+        return
+    upsert_increment(OriginAttribution, ('origin',), CREDITS,
+                     [(pk,) + tuple(n) for pk, n in totals.items()])
@@ -0,0 +1,141 @@
+"""
+Cached lookup of the origin fields needed to handle a click.
+
+Lookups go through a small per-process LRU first and then the Django cache
+framework, and only reach the database when both miss. Unknown codes are
+cached as well so that scans of random codes don't hit the database.
+
+Entries are invalidated when an `Origin` is saved or deleted. The per-process
+LRU of *other* processes can't be reached from a signal handler, which is why
+it only holds entries for a few seconds.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import get_cache
+
+
+# stored in place of the origin data for codes that don't exist
+NOT_FOUND = False
+
+
+class LRUCache(object):
+    """
+    A thread-safe mapping that holds at most `max_size` entries, evicting
+    the least recently used one, and expires entries after `timeout`
+    seconds.
+    """
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                return default
+            if expires < time.time():
+                return default
+            # re-insert to mark as most recently used
+            self._data[key] = (expires, value)
+            return value
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.time() + self.timeout, value)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class OriginResolver(object):
+    """
+    Resolves origin codes to a dict holding `pk`, `track_registrations`,
+    `redirect_to`, `parameter_list` and `parameter_set`, or `None` if there
+    is no such origin.
+    """
+    key_prefix = 'insight:origin:'
+
+    def __init__(self):
+        self.local = LRUCache(
+            getattr(settings, 'INSIGHT_ORIGIN_LOCAL_CACHE_SIZE', 1000),
+            getattr(settings, 'INSIGHT_ORIGIN_LOCAL_CACHE_TIMEOUT', 5)
+        )
+
+    @property
+    def shared(self):
+        return get_cache(getattr(settings, 'INSIGHT_CACHE_ALIAS', 'default'))
+
+    def make_key(self, code):
+        return '%s%s' % (self.key_prefix, code)
+
+    def resolve(self, code):
+        data = self.local.get(code)
+        if data is None:
+            key = self.make_key(code)
+            data = self.shared.get(key)
+            if data is None:
+                data = self.fetch(code)
+                if data is NOT_FOUND:
+                    timeout = getattr(
+                        settings, 'INSIGHT_ORIGIN_CACHE_MISS_TIMEOUT', 60)
+                else:
+                    timeout = getattr(
+                        settings, 'INSIGHT_ORIGIN_CACHE_TIMEOUT', 300)
+                self.shared.set(key, data, timeout)
+            self.local.set(code, data)
+        return data or None
+
+    def fetch(self, code):
+        from insight.models import Origin
+        try:
+            origin = Origin.objects.only(
+                'track_registrations', 'redirect_to', 'querystring_parameters'
+            ).get(code=code)
+        except Origin.DoesNotExist:
+            return NOT_FOUND
+        return {
+            'pk': origin.pk,
+            'track_registrations': origin.track_registrations,
+            'redirect_to': origin.redirect_to,
+            'parameter_list': origin.parameter_list,
+            'parameter_set': origin.parameter_set,
+        }
+
+    def invalidate(self, code):
+        self.local.delete(code)
+        self.shared.delete(self.make_key(code))
+
+    def clear(self):
+        """
+        Clears the per-process LRU. Entries in the shared cache are left to
+        expire.
+        """
+        self.local.clear()
+
+
+resolver = OriginResolver()
+
+
+def resolve_origin(code):
+    return resolver.resolve(code)
+
+
+def invalidate_origin(code):
+    resolver.invalidate(code)
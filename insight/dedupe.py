@@ -0,0 +1,72 @@
+"""
+Detection of repeated clicks.
+
+With `INSIGHT_DEDUPE_WINDOW` set, a click on an origin by a visitor whose
+last click, less than that many seconds ago, was on the same origin is a
+repeat. Repeats are only counted as hits and logged as events if
+`INSIGHT_COUNT_REPEAT_HITS` is on. A repeat only stores the origin code and
+parameters if they differ from those stored, so it usually costs no session
+write, yet never loses the parameters of a registration.
+
+Visitors are known by the id cookie of `insight.visitors.visitor_id`, never
+by their address, which visitors behind the same proxy share. Recent clicks
+are held in a per-process LRU of `INSIGHT_DEDUPE_SIZE` entries, or in the
+Django cache if `INSIGHT_DEDUPE_BACKEND` is 'cache', which also catches
+repeats handled by other processes.
+"""
+from django.conf import settings
+from django.core.cache import get_cache
+
+from insight.cache import LRUCache
+
+
+class Deduplicator(object):
+    key_prefix = 'insight:click:'
+
+    def __init__(self):
+        self._local = None
+
+    @property
+    def window(self):
+        return getattr(settings, 'INSIGHT_DEDUPE_WINDOW', 0)
+
+    @property
+    def local(self):
+        size = getattr(settings, 'INSIGHT_DEDUPE_SIZE', 10000)
+        window = self.window
+        local = self._local
+        if local is None or (local.max_size, local.timeout) != (size, window):
+            local = self._local = LRUCache(size, window)
+        return local
+
+    @property
+    def shared(self):
+        return get_cache(getattr(settings, 'INSIGHT_CACHE_ALIAS', 'default'))
+
+    def is_repeat(self, visitor, code):
+        """
+        Returns whether the last click within the window of `visitor`, the
+        visitor's id, was on `code`, and marks this click as seen.
+        """
+        window = self.window
+        if not window or not visitor:
+            return False
+        # only the last code clicked is kept per visitor, so that clicking
+        # back to an earlier origin isn't a repeat
+        key = '%s%s' % (self.key_prefix, visitor)
+        if getattr(settings, 'INSIGHT_DEDUPE_BACKEND', 'memory') == 'cache':
+            shared = self.shared
+            seen = shared.get(key) == code
+            shared.set(key, code, window)
+        else:
+            local = self.local
+            seen = local.get(key) == code
+            local.set(key, code)
+        return seen
+
+    def clear(self):
+        if self._local is not None:
+            self._local.clear()
+
+
+deduplicator = Deduplicator()
@@ -0,0 +1,251 @@
+"""
+Click event log.
+
+With `INSIGHT_EVENT_LOG` set, every click is recorded as an event holding the
+origin code, the time, the tracked querystring parameters, the referrer and a
+hash of the user agent. Events are appended either to the `Hit` model
+('database'), to a local JSON lines file rotated by size ('file'), or by any
+class with a `write(events)` method given by its dotted path.
+
+Events are queued in memory and written in batches by a background thread,
+so the redirect doesn't wait for them. The queue holds at most
+`INSIGHT_EVENT_QUEUE_SIZE` events; when it is full, new events are dropped
+('drop', the default) or the click waits up to `INSIGHT_EVENT_BLOCK_TIMEOUT`
+seconds for room before its event is dropped ('block'), as selected by
+`INSIGHT_EVENT_QUEUE_FULL`. Events still queued when a process exits are
+written by an exit handler, but are lost if the process is killed.
+"""
+import Queue
+import atexit
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import DatabaseError, connections, router
+from django.utils import timezone
+from django.utils.importlib import import_module
+
+
+logger = logging.getLogger('insight.events')
+
+
+def make_event(request, code, origin_pk, params):
+    user_agent = request.META.get('HTTP_USER_AGENT', '')
+    return {
+        'origin': origin_pk,
+        'code': code,
+        'created': timezone.now(),
+        'params': params,
+        'referrer': request.META.get('HTTP_REFERER', '')[:255],
+        'user_agent_hash': user_agent and hashlib.sha1(
+            user_agent.encode('utf-8')).hexdigest(),
+    }
+
+
+class DatabaseEventLog(object):
+
+    def write(self, events):
+        from insight.models import Hit
+        try:
+            Hit.objects.bulk_create([
+                Hit(origin_id=event['origin'],
+                    code=event['code'],
+                    created=event['created'],
+                    params=json.dumps(event['params']),
+                    referrer=event['referrer'],
+                    user_agent_hash=event['user_agent_hash'])
+                for event in events
+            ])
+        except DatabaseError:
+            # the background thread keeps its connection between batches,
+            # so a broken one is closed for the next batch to reconnect
+            connections[router.db_for_write(Hit)].close()
+            raise
+
+
+class FileEventLog(object):
+    """
+    Appends events as JSON lines to `INSIGHT_EVENT_LOG_PATH`. Once the file
+    is larger than `INSIGHT_EVENT_LOG_MAX_BYTES` it is renamed to `path.1`,
+    moving older files up to `path.INSIGHT_EVENT_LOG_BACKUPS`.
+
+    Rotation assumes the process is the only one writing the file, so with
+    several processes the path should contain ``%(pid)s``, which is replaced
+    by the id of the writing process.
+    """
+
+    @property
+    def path(self):
+        path = getattr(settings, 'INSIGHT_EVENT_LOG_PATH', 'insight-hits.log')
+        return path.replace('%(pid)s', str(os.getpid()))
+
+    @property
+    def max_bytes(self):
+        return getattr(settings, 'INSIGHT_EVENT_LOG_MAX_BYTES',
+                       100 * 1024 * 1024)
+
+    @property
+    def backups(self):
+        return getattr(settings, 'INSIGHT_EVENT_LOG_BACKUPS', 5)
+
+    def write(self, events):
+        lines = []
+        for event in events:
+            event = dict(event, created=event['created'].isoformat())
+            lines.append(json.dumps(event, sort_keys=True) + '\n')
+        path = self.path
+        with open(path, 'ab') as f:
+            f.write(''.join(lines))
+            size = f.tell()
+        if size >= self.max_bytes:
+            self.rotate(path)
+
+    def rotate(self, path):
+        backups = self.backups
+        if backups <= 0:
+            os.remove(path)
+            return
+        for i in range(backups - 1, 0, -1):
+            source = '%s.%d' % (path, i)
+            if os.path.exists(source):
+                os.rename(source, '%s.%d' % (path, i + 1))
+        os.rename(path, '%s.1' % path)
+
+
+EVENT_LOGS = {
+    'database': DatabaseEventLog,
+    'file': FileEventLog,
+}
+
+
+def get_event_log():
+    """
+    Returns the event log selected by `INSIGHT_EVENT_LOG`, or `None`.
+    """
+    name = getattr(settings, 'INSIGHT_EVENT_LOG', None)
+    if not name:
+        return None
+    if name in EVENT_LOGS:
+        return EVENT_LOGS[name]()
+    module, attr = name.rsplit('.', 1)
+    return getattr(import_module(module), attr)()
+
+
+class EventRecorder(object):
+    """
+    Queues click events and writes them in batches of at most
+    `INSIGHT_EVENT_BATCH_SIZE` from a background thread, which waits up to
+    `INSIGHT_EVENT_FLUSH_INTERVAL` seconds to fill a batch.
+    """
+
+    def __init__(self):
+        self._queue = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        # events dropped because the queue was full or couldn't be written
+        self.dropped = 0
+
+    @property
+    def queue(self):
+        if self._queue is None:
+            with self._lock:
+                if self._queue is None:
+                    self._queue = Queue.Queue(getattr(
+                        settings, 'INSIGHT_EVENT_QUEUE_SIZE', 10000))
+        return self._queue
+
+    def record(self, request, code, origin_pk, params):
+        if not getattr(settings, 'INSIGHT_EVENT_LOG', None):
+            return
+        event = make_event(request, code, origin_pk, params)
+        if not getattr(settings, 'INSIGHT_EVENT_ASYNC', True):
+            self.write([event])
+            return
+        self.start()
+        try:
+            policy = getattr(settings, 'INSIGHT_EVENT_QUEUE_FULL', 'drop')
+            if policy == 'block':
+                self.queue.put(event, timeout=getattr(
+                    settings, 'INSIGHT_EVENT_BLOCK_TIMEOUT', 0.1))
+            else:
+                self.queue.put_nowait(event)
+        except Queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self.run,
+                                                name='insight-events')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def run(self):
+        while not self._stopping.is_set():
+            self.write_batch(block=True)
+
+    def write_batch(self, block=False):
+        """
+        Writes the next batch of queued events and returns its size.
+        """
+        queue = self.queue
+        interval = getattr(settings, 'INSIGHT_EVENT_FLUSH_INTERVAL', 1)
+        batch_size = getattr(settings, 'INSIGHT_EVENT_BATCH_SIZE', 500)
+        events = []
+        try:
+            events.append(queue.get(block, interval))
+            while len(events) < batch_size:
+                events.append(queue.get_nowait())
+        except Queue.Empty:
+            pass
+        if events:
+            try:
+                self.write(events)
+            finally:
+                for event in events:
+                    queue.task_done()
+        return len(events)
+
+    def write(self, events):
+        try:
+            event_log = get_event_log()
+            if event_log is not None:
+                event_log.write(events)
+        except Exception:
+            with self._lock:
+                self.dropped += len(events)
+            logger.exception("Could not write %d click events", len(events))
+
+    def flush(self):
+        """
+        Waits until all queued events are written, writing them from this
+        thread if the background thread isn't running.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            self.queue.join()
+        else:
+            while self.write_batch():
+                pass
+
+    def stop(self):
+        """
+        Stops the background thread and writes the events still queued.
+        """
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._stopping.set()
+            thread.join()
+            self._stopping.clear()
+        self.flush()
+
+
+recorder = EventRecorder()
+# the thread is stopped before the interpreter tears down the modules it uses
+atexit.register(recorder.stop)
@@ -0,0 +1,130 @@
+"""
+Streaming exports of registrations and querystring parameter counters.
+
+Rows are read in batches with keyset pagination on the primary key, so
+memory use doesn't grow with the size of the table, from
+`INSIGHT_REPORTING_DATABASE` if set.
+"""
+import csv
+import json
+
+from insight.models import QuerystringParameter, Registration, User
+from insight.routers import reporting
+
+
+FORMATS = ('csv', 'jsonl')
+
+USERNAME_FIELD = getattr(User, 'USERNAME_FIELD', 'username')
+
+REGISTRATION_COLUMNS = ('id', 'user_id', 'username', 'origin_id',
+                        'origin_code', 'created')
+PARAMETER_COLUMNS = ('id', 'origin_id', 'origin_code', 'identifier', 'value',
+                     'number_of_registrations', 'number_of_hits')
+
+
+def iterate(queryset, fields, batch_size):
+    """
+    Yields the `fields` of each row in `queryset` by primary key, one batch
+    of `batch_size` rows at a time.
+    """
+    last_pk = None
+    queryset = queryset.order_by('pk')
+    while True:
+        batch = queryset
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        rows = list(batch.values_list('pk', *fields)[:batch_size])
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            return
+        last_pk = rows[-1][0]
+
+
+def filter_origins(queryset, prefix, origins=None, group=None):
+    if origins is not None:
+        queryset = queryset.filter(**{'%s__in' % prefix: origins})
+    if group is not None:
+        queryset = queryset.filter(**{'%s__origin_group' % prefix: group})
+    return queryset
+
+
+def registration_rows(origins=None, group=None, since=None, until=None,
+                      batch_size=1000):
+    """
+    Yields (id, user id, username, origin id, origin code, created) of the
+    registrations from `origins` or `group`, created from `since` and before
+    `until`.
+    """
+    queryset = filter_origins(reporting(Registration.objects.all()),
+                              'origin', origins, group)
+    if since is not None:
+        queryset = queryset.filter(created__gte=since)
+    if until is not None:
+        queryset = queryset.filter(created__lt=until)
+    return iterate(
+        queryset,
+        ('user', 'user__%s' % USERNAME_FIELD, 'origin', 'origin__code',
+         'created'),
+        batch_size
+    )
+
+
+def parameter_rows(origins=None, group=None, batch_size=1000):
+    """
+    Yields (id, origin id, origin code, identifier, value, registrations,
+    hits) of the querystring parameters of `origins` or `group`.
+    """
+    queryset = filter_origins(reporting(QuerystringParameter.objects.all()),
+                              'origin', origins, group)
+    return iterate(
+        queryset,
+        ('origin', 'origin__code', 'identifier', 'value',
+         'number_of_registrations', 'number_of_hits'),
+        batch_size
+    )
+
+
+class Echo(object):
+    """
+    A file-like object that returns what is written to it.
+    """
+
+    def write(self, value):
+        return value
+
+
+def encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def csv_lines(columns, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([encode(value) for value in row])
+
+
+def jsonl_lines(columns, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, [encode(v) for v in row]))) + '\n'
+
+
+def export_lines(kind, format='csv', **filters):
+    """
+    Yields the lines of an export of `kind` ('registrations' or
+    'parameters') in `format` ('csv' or 'jsonl').
+    """
+    if kind == 'registrations':
+        columns, rows = REGISTRATION_COLUMNS, registration_rows(**filters)
+    elif kind == 'parameters':
+        columns, rows = PARAMETER_COLUMNS, parameter_rows(**filters)
+    else:
+        raise ValueError("Unknown export %r" % kind)
+    if format == 'jsonl':
+        return jsonl_lines(columns, rows)
+    return csv_lines(columns, rows)
@@ -0,0 +1,60 @@
+"""
+Conversion from hits to registrations per origin and querystring parameter
+value.
+
+Both counts are kept on `Origin` and `QuerystringParameter` as they are
+tracked, so a funnel is read without aggregating any clicks or
+registrations. The top values of an origin are ranked by registrations
+using their (origin, number_of_registrations) index; registrations still
+held in counter shards aren't ranked until they are folded.
+"""
+from insight.models import Origin, QuerystringParameter
+from insight.routers import reporting
+
+
+def conversion(registrations, hits):
+    """
+    Returns the percentage of `hits` that registered, or `None` without
+    hits.
+    """
+    if not hits:
+        return None
+    return 100.0 * registrations / hits
+
+
+def funnel_row(registrations, hits, **extra):
+    row = {
+        'registrations': registrations,
+        'hits': hits,
+        'conversion': conversion(registrations, hits),
+    }
+    row.update(extra)
+    return row
+
+
+def origin_funnel(origin, limit=10, identifier=None):
+    """
+    Returns the hits, registrations and conversion of `origin` (an `Origin`
+    or its pk) and of its `limit` querystring parameter values with the most
+    registrations, optionally only those of `identifier`.
+    """
+    origin_pk = getattr(origin, 'pk', origin)
+    title, code, registrations, hits = reporting(Origin.objects.filter(
+        pk=origin_pk)).values_list(
+        'title', 'code', 'number_of_registrations', 'number_of_hits').get()
+    parameters = reporting(QuerystringParameter.objects.filter(
+        origin=origin_pk))
+    if identifier is not None:
+        parameters = parameters.filter(identifier=identifier)
+    parameters = parameters.order_by('-number_of_registrations').values_list(
+        'identifier', 'value', 'number_of_registrations', 'number_of_hits')
+    return {
+        'origin': funnel_row(registrations, hits, pk=origin_pk, title=title,
+                             code=code),
+        'parameters': [
+            funnel_row(registrations, hits, identifier=identifier,
+                       value=value)
+            for identifier, value, registrations, hits
+            in parameters[:limit]
+        ],
+    }
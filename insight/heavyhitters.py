@@ -0,0 +1,156 @@
+"""
+Bounded counting of querystring parameters with unbounded values.
+
+Each distinct value of a tracked parameter gets its own
+`QuerystringParameter` row, so a parameter like a click id grows the table
+with every click. For the parameters in `INSIGHT_HEAVY_HITTER_PARAMETERS`
+only the heavy hitters get a row. All other values are counted in the row
+with the value `OTHER`.
+
+Heavy hitters are found with a Space-Saving sketch per origin and parameter.
+The sketch monitors at most `INSIGHT_HEAVY_HITTER_CAPACITY` values. A new
+value takes the place of the least counted one and inherits its count as
+the possible error. A value is promoted once it has been seen at least
+`INSIGHT_HEAVY_HITTER_MIN_COUNT` times while monitored. Promotion gives it a
+row, and a value with a row is counted in it from then on, even once the
+sketch no longer monitors it. Counts from before the promotion stay in the
+`OTHER` row.
+
+Only buffered hits and batches of deferred registrations feed the sketch,
+which is persisted as JSON in `ParameterSketch` and locked while a batch
+updates it. Registrations tracked at login don't touch the sketch, so there
+is no single row every login waits for; their values are counted in their
+own row if they have been promoted and under `OTHER` otherwise.
+"""
+import json
+from collections import defaultdict
+
+from django.conf import settings
+
+from insight.models import ParameterSketch, QuerystringParameter
+
+
+OTHER = u'(other)'
+
+
+def heavy_hitter_parameters():
+    return frozenset(getattr(settings, 'INSIGHT_HEAVY_HITTER_PARAMETERS', ()))
+
+
+class SpaceSaving(object):
+    """
+    Approximate counts of the most frequent values in a stream, holding at
+    most `capacity` (value, count, error) counters.
+    """
+
+    def __init__(self, capacity, counters=None):
+        self.capacity = capacity
+        # value: [count, error], where count overestimates by at most error
+        self.counters = dict(counters or {})
+
+    def add(self, value, n=1):
+        counter = self.counters.get(value)
+        if counter is not None:
+            counter[0] += n
+            return
+        if len(self.counters) < self.capacity:
+            self.counters[value] = [n, 0]
+            return
+        evicted = min(self.counters, key=lambda v: self.counters[v][0])
+        count = self.counters.pop(evicted)[0]
+        self.counters[value] = [count + n, count]
+
+    def guaranteed(self, value):
+        """
+        Returns how often `value` has at least been seen while monitored.
+        """
+        counter = self.counters.get(value)
+        if counter is None:
+            return 0
+        return counter[0] - counter[1]
+
+    def top(self, k=None):
+        """
+        Returns the monitored (value, count, error) by descending count.
+        """
+        ranked = sorted(((v, c, e) for v, (c, e) in self.counters.items()),
+                        key=lambda t: (-t[1], t[0]))
+        return ranked[:k] if k is not None else ranked
+
+
+def load_sketch(origin_pk, identifier):
+    sketch, created = ParameterSketch.objects.select_for_update() \
+        .get_or_create(origin_id=origin_pk, identifier=identifier)
+    capacity = getattr(settings, 'INSIGHT_HEAVY_HITTER_CAPACITY', 100)
+    counters = json.loads(sketch.counters) if sketch.counters else {}
+    return sketch, SpaceSaving(capacity, counters)
+
+
+def promoted(keys):
+    """
+    Returns those of the (origin pk, identifier, value) `keys` that have
+    their own row.
+    """
+    keys = set(keys)
+    if not keys:
+        return set()
+    rows = QuerystringParameter.objects.filter(
+        origin__in=set(key[0] for key in keys),
+        identifier__in=set(key[1] for key in keys),
+        value__in=set(key[2] for key in keys)
+    ).values_list('origin', 'identifier', 'value')
+    return keys.intersection(rows)
+
+
+def heavy_hitter_keys(counts):
+    parameters = heavy_hitter_parameters()
+    return [key for key in counts
+            if key[1] in parameters and key[2] != OTHER]
+
+
+def bucket_values(counts, feed=True):
+    """
+    Returns the value each of the keys of `counts[(origin pk, identifier,
+    value)]` is counted under: its own if it is or becomes a heavy hitter,
+    `OTHER` if not. Unless `feed` is false, the values of heavy-hitter
+    parameters without a row are fed to their sketches first.
+    """
+    keys = heavy_hitter_keys(counts)
+    buckets = dict((key, key[2]) for key in counts)
+    if not keys:
+        return buckets
+    pinned = promoted(keys)
+    grouped = defaultdict(list)
+    for key in keys:
+        if key not in pinned:
+            buckets[key] = OTHER
+            grouped[key[:2]].append(key[2])
+    if not feed:
+        return buckets
+    min_count = getattr(settings, 'INSIGHT_HEAVY_HITTER_MIN_COUNT', 2)
+    # a consistent order avoids deadlocks between concurrent batches
+    for (origin_pk, identifier), values in sorted(grouped.items()):
+        row, sketch = load_sketch(origin_pk, identifier)
+        for value in values:
+            sketch.add(value, counts[(origin_pk, identifier, value)])
+            if sketch.guaranteed(value) >= min_count:
+                buckets[(origin_pk, identifier, value)] = value
+        row.counters = json.dumps(sketch.counters, separators=(',', ':'))
+        row.save()
+    return buckets
+
+
+def bucket_counts(counts, buckets=None, feed=True):
+    """
+    Returns `counts`, keyed on (origin pk, identifier, value, ...), with the
+    values of heavy-hitter parameters replaced by their bucket and the
+    counts of each bucket added up. `buckets` are computed from `counts` if
+    not given.
+    """
+    if buckets is None:
+        buckets = bucket_values(counts, feed)
+    bucketed = defaultdict(int)
+    for key, n in counts.items():
+        value = buckets.get(key[:3], key[2])
+        bucketed[key[:2] + (value,) + key[3:]] += n
+    return dict(bucketed)
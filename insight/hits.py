@@ -0,0 +1,182 @@
+"""
+Buffered hit counting.
+
+Hits are added up per origin and per tracked querystring parameter value,
+either in memory in each process or in the Django cache using atomic
+increments, and are written to the `number_of_hits` columns in bulk at most
+every `INSIGHT_HIT_FLUSH_INTERVAL` seconds.
+
+Hits buffered in memory are flushed by an exit handler when a process exits,
+but are lost if it is killed. Hits buffered in the cache survive that too
+and are flushed by whichever process
+next records a hit for the same origin or parameter value. A process takes a
+cached counter under a lock held with an atomic `add`, so processes flushing
+at the same time never both take the same hits.
+
+A flush runs in the click that triggers it, so hits that can't be written,
+e.g. of an origin deleted meanwhile, are logged and dropped rather than
+failing the redirect.
+"""
+import atexit
+import hashlib
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.db import transaction
+from django.utils import timezone
+
+from insight.heavyhitters import bucket_counts
+from insight.instrumentation import measure
+from insight.models import Origin, QuerystringParameter, rollups_enabled
+from insight.rollups import rollup_origins, rollup_parameters
+from insight.sql import bulk_increment
+
+
+logger = logging.getLogger('insight.hits')
+
+
+class HitCounter(object):
+    key_prefix = 'insight:hits:'
+
+    def __init__(self):
+        self._counts = defaultdict(int)
+        # maps the cache keys incremented by this process to their hit keys
+        self._cache_keys = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.time()
+        # hits that couldn't be written
+        self.dropped = 0
+
+    @property
+    def backend(self):
+        return getattr(settings, 'INSIGHT_HIT_COUNTER', 'memory')
+
+    @property
+    def cache(self):
+        return get_cache(getattr(settings, 'INSIGHT_CACHE_ALIAS', 'default'))
+
+    def make_cache_key(self, key):
+        origin_pk, identifier, value = key
+        if identifier is None:
+            return '%s%s' % (self.key_prefix, origin_pk)
+        # parameter values may contain characters memcached won't accept
+        digest = hashlib.md5(
+            (u'%s=%s' % (identifier, value)).encode('utf-8')).hexdigest()
+        return '%s%s:%s' % (self.key_prefix, origin_pk, digest)
+
+    def record(self, origin_pk, params=None):
+        """
+        Counts a hit on the origin and on each of `params`, a dict of
+        tracked querystring parameters.
+        """
+        if not self.backend:
+            return
+        keys = [(origin_pk, None, None)]
+        for identifier, value in (params or {}).items():
+            keys.append((origin_pk, identifier, value))
+
+        if self.backend == 'cache':
+            self._incr_cache(keys)
+        else:
+            with self._lock:
+                for key in keys:
+                    self._counts[key] += 1
+
+        interval = getattr(settings, 'INSIGHT_HIT_FLUSH_INTERVAL', 10)
+        max_size = getattr(settings, 'INSIGHT_HIT_BUFFER_SIZE', 10000)
+        if (time.time() - self._last_flush >= interval or
+                len(self._counts) + len(self._cache_keys) >= max_size):
+            self.flush()
+
+    def _incr_cache(self, keys):
+        cache = self.cache
+        timeout = getattr(settings, 'INSIGHT_HIT_CACHE_TIMEOUT', 60 * 60 * 24)
+        for key in keys:
+            cache_key = self.make_cache_key(key)
+            try:
+                cache.incr(cache_key)
+            except ValueError:
+                if not cache.add(cache_key, 1, timeout):
+                    cache.incr(cache_key)
+            with self._lock:
+                self._cache_keys[cache_key] = key
+
+    def collect(self):
+        """
+        Returns the buffered hit counts, keyed on (origin pk, identifier,
+        value), and resets the buffer. Origin totals have `None` as
+        identifier and value.
+        """
+        with self._lock:
+            counts, self._counts = self._counts, defaultdict(int)
+            cache_keys, self._cache_keys = self._cache_keys, {}
+            self._last_flush = time.time()
+        if cache_keys:
+            cache = self.cache
+            for cache_key, key in cache_keys.items():
+                n = self._take_cached(cache, cache_key)
+                if n:
+                    counts[key] += n
+        return counts
+
+    def _take_cached(self, cache, cache_key):
+        """
+        Returns the hits counted in `cache_key` and subtracts them.
+        """
+        # the read and the decrement aren't atomic together, so a process
+        # only takes a counter while it holds its lock; a process that can't
+        # get it leaves the counter to the process flushing it
+        lock = '%s:lock' % cache_key
+        if not cache.add(lock, 1, 60):
+            return 0
+        try:
+            n = cache.get(cache_key)
+            if n:
+                # hits recorded in the meantime stay in the cache
+                cache.decr(cache_key, n)
+            return n
+        finally:
+            cache.delete(lock)
+
+    def flush(self):
+        counts = self.collect()
+        if not counts:
+            return
+        try:
+            with measure('hit_flush'):
+                write_hits(counts)
+        except Exception:
+            hits = sum(n for (origin_pk, identifier, value), n
+                       in counts.items() if identifier is None)
+            with self._lock:
+                self.dropped += hits
+            logger.exception("Could not write %d hits", hits)
+
+
+@transaction.commit_on_success
+def write_hits(counts):
+    origin_hits = {}
+    param_hits = {}
+    for (origin_pk, identifier, value), n in counts.items():
+        if identifier is None:
+            origin_hits[origin_pk] = n
+        else:
+            param_hits[(origin_pk, identifier, value)] = n
+    param_hits = bucket_counts(param_hits)
+    bulk_increment(Origin, 'number_of_hits', origin_hits)
+    QuerystringParameter.objects.increment('number_of_hits', param_hits)
+    if rollups_enabled():
+        now = timezone.now()
+        rollup_origins('number_of_hits', dict(
+            ((origin_pk, now), n) for origin_pk, n in origin_hits.items()))
+        rollup_parameters('number_of_hits', dict(
+            (key + (now,), n) for key, n in param_hits.items()))
+
+
+hit_counter = HitCounter()
+# hits buffered in memory are written before the process exits
+atexit.register(hit_counter.flush)
@@ -0,0 +1,91 @@
+"""
+A HyperLogLog sketch for estimating the number of distinct items.
+
+Sketches of the same precision can be merged, and the merged sketch
+estimates the distinct items added to any of them. With precision `p` a
+sketch holds 2 ** p one-byte registers. The standard error is about
+1.04 / sqrt(2 ** p), e.g. 1.6% with the default precision of 12.
+"""
+import base64
+import hashlib
+import math
+import struct
+import zlib
+
+
+def hash_item(item):
+    if isinstance(item, unicode):
+        item = item.encode('utf-8')
+    return struct.unpack('>Q', hashlib.sha1(item).digest()[:8])[0]
+
+
+def position(item, precision=12):
+    """
+    Returns the register `item` falls in and its rank there, so updates can
+    be buffered without a sketch.
+    """
+    h = hash_item(item)
+    bits = 64 - precision
+    index = h >> bits
+    rest = h & ((1 << bits) - 1)
+    # the position of the leftmost 1 in the remaining bits
+    rank = bits - rest.bit_length() + 1
+    return index, rank
+
+
+class HyperLogLog(object):
+
+    def __init__(self, precision=12, registers=None):
+        self.precision = precision
+        self.m = 1 << precision
+        if registers is None:
+            registers = bytearray(self.m)
+        elif len(registers) != self.m:
+            raise ValueError("Expected %d registers, got %d"
+                             % (self.m, len(registers)))
+        self.registers = registers
+
+    def position(self, item):
+        return position(item, self.precision)
+
+    def add(self, item):
+        index, rank = self.position(item)
+        self.update(index, rank)
+
+    def update(self, index, rank):
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Can't merge sketches of precision %d and %d"
+                             % (self.precision, other.precision))
+        registers = self.registers
+        for i, rank in enumerate(other.registers):
+            if rank > registers[i]:
+                registers[i] = rank
+
+    def count(self):
+        m = self.m
+        if m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(b'\x00')
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more accurate for small cardinalities
+            estimate = m * math.log(float(m) / zeros)
+        return int(round(estimate))
+
+    def dumps(self):
+        """
+        Returns the registers compressed and base64 encoded, which is small
+        for sketches of few items.
+        """
+        return base64.b64encode(zlib.compress(bytes(self.registers)))
+
+    @classmethod
+    def loads(cls, data, precision=12):
+        return cls(precision, bytearray(zlib.decompress(
+            base64.b64decode(data))))
@@ -0,0 +1,208 @@
+"""
+Opt-in timing and query counting of insight's operations.
+
+With `INSIGHT_INSTRUMENTATION` on, each operation wrapped in `measure` sends
+`insight.signals.operation_measured` with its duration in seconds and the
+number of queries it ran. `aggregator` keeps the latest samples of each
+operation in every process and publishes them to the cache, from where the
+`insight_instrumentation` command reports percentiles.
+
+With instrumentation off, `measure` returns a shared no-op context manager.
+"""
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from insight.signals import operation_measured
+
+
+OPERATIONS = (
+    'origin_lookup',
+    'storage_save',
+    'registration_insert',
+    'counter_update',
+    'parameter_upsert',
+    'hit_flush',
+    'visitor_flush',
+)
+
+
+class NoopMeasurement(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NOOP = NoopMeasurement()
+
+
+class Measurement(object):
+
+    def __init__(self, operation, using=DEFAULT_DB_ALIAS):
+        self.operation = operation
+        self.connection = connections[using]
+
+    def __enter__(self):
+        connection = self.connection
+        # queries are only logged by a debug cursor; if logging is forced
+        # here, the logged queries are dropped again on exit
+        self.forced = not (connection.use_debug_cursor or (
+            connection.use_debug_cursor is None and settings.DEBUG))
+        if self.forced:
+            self.use_debug_cursor = connection.use_debug_cursor
+            connection.use_debug_cursor = True
+        self.queries = len(connection.queries)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.time() - self.start
+        connection = self.connection
+        queries = len(connection.queries) - self.queries
+        if self.forced:
+            del connection.queries[self.queries:]
+            connection.use_debug_cursor = self.use_debug_cursor
+        operation_measured.send(sender=None, operation=self.operation,
+                                duration=duration, queries=queries)
+        return False
+
+
+def measure(operation, using=DEFAULT_DB_ALIAS):
+    if getattr(settings, 'INSIGHT_INSTRUMENTATION', False):
+        return Measurement(operation, using)
+    return NOOP
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+class Aggregator(object):
+    """
+    Keeps the latest `INSIGHT_INSTRUMENTATION_SAMPLES` samples of each
+    operation and publishes them to the cache at most every
+    `INSIGHT_INSTRUMENTATION_PUBLISH_INTERVAL` seconds.
+    """
+    key_prefix = 'insight:instrumentation:'
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+        self._last_publish = 0
+
+    @property
+    def cache(self):
+        return get_cache(getattr(settings, 'INSIGHT_CACHE_ALIAS', 'default'))
+
+    @property
+    def index_key(self):
+        return '%sprocesses' % self.key_prefix
+
+    @property
+    def lock_key(self):
+        return '%sprocesses:lock' % self.key_prefix
+
+    def process_key(self, process):
+        return '%s%s' % (self.key_prefix, process)
+
+    def process_name(self):
+        # pids are only unique per host, and hosts may share a cache
+        return '%s:%s' % (socket.gethostname(), os.getpid())
+
+    def record(self, sender, operation, duration, queries, **kwargs):
+        size = getattr(settings, 'INSIGHT_INSTRUMENTATION_SAMPLES', 1000)
+        with self._lock:
+            samples = self.samples.get(operation)
+            if samples is None or samples.maxlen != size:
+                samples = self.samples[operation] = deque(samples or (),
+                                                          maxlen=size)
+            samples.append((duration, queries))
+        interval = getattr(settings,
+                           'INSIGHT_INSTRUMENTATION_PUBLISH_INTERVAL', 10)
+        if time.time() - self._last_publish >= interval:
+            self.publish()
+
+    def publish(self):
+        with self._lock:
+            self._last_publish = time.time()
+            samples = dict((op, list(s)) for op, s in self.samples.items())
+        cache = self.cache
+        process = self.process_name()
+        timeout = getattr(settings, 'INSIGHT_INSTRUMENTATION_TIMEOUT', 3600)
+        cache.set(self.process_key(process), samples, timeout)
+        if process not in (cache.get(self.index_key) or []):
+            self.register(process, timeout)
+
+    def register(self, process, timeout):
+        """
+        Adds `process` to the index of publishing processes, dropping those
+        whose samples have expired.
+        """
+        cache = self.cache
+        # the index is read and written back, so only the process holding
+        # the lock updates it; the others retry on their next publish
+        if not cache.add(self.lock_key, 1, 10):
+            return
+        try:
+            processes = cache.get(self.index_key) or []
+            published = cache.get_many(
+                [self.process_key(p) for p in processes])
+            processes = [p for p in processes
+                         if self.process_key(p) in published]
+            if process not in processes:
+                processes.append(process)
+            cache.set(self.index_key, processes, timeout)
+        finally:
+            cache.delete(self.lock_key)
+
+    def collect(self):
+        """
+        Returns the published samples of all processes, per operation.
+        """
+        cache = self.cache
+        processes = cache.get(self.index_key) or []
+        collected = {}
+        published = cache.get_many([self.process_key(p) for p in processes])
+        for samples in published.values():
+            for operation, values in samples.items():
+                collected.setdefault(operation, []).extend(values)
+        return collected
+
+    def reset(self):
+        cache = self.cache
+        processes = cache.get(self.index_key) or []
+        cache.delete_many([self.process_key(p) for p in processes] +
+                          [self.index_key])
+        with self._lock:
+            self.samples = {}
+
+
+def summarize(samples):
+    """
+    Returns the count and the 50th, 95th and 99th percentiles of duration
+    (in milliseconds) and queries of `samples`.
+    """
+    durations = [duration * 1000 for duration, queries in samples]
+    queries = [queries for duration, queries in samples]
+    summary = {'count': len(samples)}
+    for p in (50, 95, 99):
+        summary['p%d_ms' % p] = percentile(durations, p)
+        summary['p%d_queries' % p] = percentile(queries, p)
+    return summary
+
+
+aggregator = Aggregator()
+operation_measured.connect(aggregator.record,
+                           dispatch_uid='insight.instrumentation.aggregator')
@@ -0,0 +1,36 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import CommandError, NoArgsCommand
+
+from insight.retention import archivable, archive_registrations
+
+
+class Command(NoArgsCommand):
+    help = ("Archives registrations older than the retention period as "
+            "daily counts per origin.")
+    option_list = NoArgsCommand.option_list + (
+        make_option('--days', type='int', default=None,
+                    help='The retention period in days. Defaults to '
+                         'INSIGHT_REGISTRATION_RETENTION_DAYS.'),
+        make_option('--batch-size', type='int', default=1000,
+                    help='The number of registrations archived per batch.'),
+        make_option('--dry-run', action='store_true', default=False,
+                    help='Only show how many registrations would be '
+                         'archived.'),
+    )
+
+    def handle_noargs(self, **options):
+        days = options['days']
+        if days is None:
+            days = getattr(settings, 'INSIGHT_REGISTRATION_RETENTION_DAYS',
+                           None)
+        if days is None:
+            raise CommandError("Pass --days or set "
+                               "INSIGHT_REGISTRATION_RETENTION_DAYS.")
+        if options['dry_run']:
+            self.stdout.write("Would archive %d registrations\n"
+                              % archivable(days).count())
+            return
+        archived = archive_registrations(days, options['batch_size'])
+        self.stdout.write("Archived %d registrations\n" % archived)
@@ -0,0 +1,59 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from insight.models import Origin, OriginGroup
+
+
+class Command(BaseCommand):
+    args = '<csv file>'
+    help = ("Creates origins from a CSV file with a header row. The title "
+            "column is required; code, description, redirect_to, "
+            "origin_group (a group title) and querystring_parameters "
+            "(separated by spaces) are optional. Writes the title, code and "
+            "URL of each origin created as CSV.")
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Specify the CSV file to read origins from.")
+        with open(args[0], 'rb') as f:
+            rows = [dict((k, v.decode('utf-8')) for k, v in row.items() if v)
+                    for row in csv.DictReader(f)]
+        if any('title' not in row for row in rows):
+            raise CommandError("Every origin needs a title.")
+
+        codes = [row['code'] for row in rows if 'code' in row]
+        if len(set(codes)) < len(codes):
+            raise CommandError("The file contains duplicate codes.")
+        taken = []
+        for i in range(0, len(codes), 500):
+            taken.extend(Origin.objects.filter(code__in=codes[i:i + 500])
+                         .values_list('code', flat=True))
+        if taken:
+            raise CommandError("These codes are already taken: %s"
+                               % ", ".join(taken))
+
+        groups = {}
+        for title in set(row.get('origin_group') for row in rows):
+            if title:
+                groups[title], created = \
+                    OriginGroup.objects.get_or_create(title=title)
+
+        origins = [
+            Origin(
+                title=row['title'],
+                code=row.get('code', ''),
+                description=row.get('description'),
+                redirect_to=row.get('redirect_to'),
+                origin_group=groups.get(row.get('origin_group')),
+                querystring_parameters="\n".join(
+                    row.get('querystring_parameters', '').split()) or None
+            )
+            for row in rows
+        ]
+        Origin.objects.bulk_create_origins(origins)
+
+        writer = csv.writer(self.stdout)
+        for origin in origins:
+            writer.writerow([origin.title.encode('utf-8'), origin.code,
+                             origin.get_absolute_url()])
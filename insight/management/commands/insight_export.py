@@ -0,0 +1,59 @@
+import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from insight.export import FORMATS, export_lines
+from insight.models import Origin
+
+
+def parse_date(value):
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise CommandError("Dates need to be given as YYYY-MM-DD, not %r"
+                           % value)
+
+
+class Command(BaseCommand):
+    args = '<registrations|parameters>'
+    help = "Exports registrations or querystring parameter counters."
+    option_list = BaseCommand.option_list + (
+        make_option('--format', choices=FORMATS, default='csv',
+                    help='Either csv or jsonl.'),
+        make_option('--origin', action='append', dest='codes',
+                    help='The code of an origin to export. Can be repeated.'),
+        make_option('--group', type='int',
+                    help='The id of an origin group to export.'),
+        make_option('--since', help='Export registrations created on or '
+                                    'after this date (YYYY-MM-DD).'),
+        make_option('--until', help='Export registrations created before '
+                                    'this date (YYYY-MM-DD).'),
+        make_option('--output', help='The file to write to. Defaults to '
+                                     'standard output.'),
+        make_option('--batch-size', type='int', default=1000,
+                    help='The number of rows read per query.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1 or args[0] not in ('registrations', 'parameters'):
+            raise CommandError("Specify either registrations or parameters.")
+        filters = {'batch_size': options['batch_size']}
+        if options['codes']:
+            filters['origins'] = list(Origin.objects.filter(
+                code__in=options['codes']).values_list('pk', flat=True))
+        if options['group']:
+            filters['group'] = options['group']
+        if args[0] == 'registrations':
+            if options['since']:
+                filters['since'] = parse_date(options['since'])
+            if options['until']:
+                filters['until'] = parse_date(options['until'])
+
+        lines = export_lines(args[0], options['format'], **filters)
+        if options['output']:
+            with open(options['output'], 'wb') as out:
+                out.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
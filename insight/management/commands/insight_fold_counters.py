@@ -0,0 +1,34 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from insight.models import (Origin, QuerystringParameter,
+                            OriginCounterShard,
+                            QuerystringParameterCounterShard)
+from insight.sql import bulk_increment
+
+
+class Command(NoArgsCommand):
+    help = "Folds registration counter shards into the registration counts."
+
+    def handle_noargs(self, **options):
+        for model, shard_model in ((Origin, OriginCounterShard),
+                                   (QuerystringParameter,
+                                    QuerystringParameterCounterShard)):
+            folded = self.fold(model, shard_model)
+            self.stdout.write("Folded %d registrations into %s counters\n"
+                              % (folded, model._meta.verbose_name))
+
+    @transaction.commit_on_success
+    def fold(self, model, shard_model):
+        shards = shard_model.objects.exclude(number_of_registrations=0) \
+            .values_list('pk', shard_model.counted_field,
+                         'number_of_registrations')
+        totals = {}
+        decrements = {}
+        for pk, counted_pk, n in shards:
+            totals[counted_pk] = totals.get(counted_pk, 0) + n
+            decrements[pk] = -n
+        # subtracting what was read keeps increments made in the meantime
+        bulk_increment(model, 'number_of_registrations', totals)
+        bulk_increment(shard_model, 'number_of_registrations', decrements)
+        return sum(totals.values())
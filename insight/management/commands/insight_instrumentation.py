@@ -0,0 +1,32 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from insight.instrumentation import aggregator, summarize
+
+
+class Command(NoArgsCommand):
+    help = ("Reports percentiles of the duration and queries of insight's "
+            "operations, as published with INSIGHT_INSTRUMENTATION on.")
+    option_list = NoArgsCommand.option_list + (
+        make_option('--reset', action='store_true', default=False,
+                    help='Discard the published samples afterwards.'),
+    )
+
+    def handle_noargs(self, **options):
+        samples = aggregator.collect()
+        if not samples:
+            self.stdout.write("No samples have been published.\n")
+        else:
+            self.stdout.write("%-20s %8s %9s %9s %9s %8s %8s %8s\n" % (
+                'operation', 'count', 'p50 ms', 'p95 ms', 'p99 ms',
+                'p50 q', 'p95 q', 'p99 q'))
+        for operation in sorted(samples):
+            summary = summarize(samples[operation])
+            summary['operation'] = operation
+            self.stdout.write(
+                "%(operation)-20s %(count)8d %(p50_ms)9.2f %(p95_ms)9.2f "
+                "%(p99_ms)9.2f %(p50_queries)8d %(p95_queries)8d "
+                "%(p99_queries)8d\n" % summary)
+        if options['reset']:
+            aggregator.reset()
@@ -0,0 +1,28 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from insight.tracking import process_pending
+
+
+class Command(NoArgsCommand):
+    help = "Tracks registrations captured with INSIGHT_DEFERRED_TRACKING."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type='int', default=500,
+                    help='The number of registrations tracked per batch.'),
+        make_option('--forever', action='store_true', default=False,
+                    help='Keep polling for pending registrations.'),
+        make_option('--interval', type='float', default=5,
+                    help='Seconds to wait between polls with --forever.'),
+    )
+
+    def handle_noargs(self, **options):
+        while True:
+            processed = process_pending(options['batch_size'])
+            if int(options['verbosity']) > 1 or not options['forever']:
+                self.stdout.write("Tracked %d pending registrations\n"
+                                  % processed)
+            if not options['forever']:
+                break
+            time.sleep(options['interval'])
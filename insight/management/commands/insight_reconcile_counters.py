@@ -0,0 +1,47 @@
+from itertools import chain
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from insight.hits import hit_counter
+from insight.reconcile import reconcile_origins, reconcile_parameters
+
+
+class Command(NoArgsCommand):
+    help = ("Recomputes the origin registration counters from the "
+            "registrations and corrects those that have drifted.")
+    option_list = NoArgsCommand.option_list + (
+        make_option('--dry-run', action='store_true', default=False,
+                    help='Only show the corrections.'),
+        make_option('--batch-size', type='int', default=500,
+                    help='The number of counters corrected at once.'),
+        make_option('--hits', action='store_true', default=False,
+                    help='Also recompute the origin hit counters from the '
+                         'Hit event log. Only use it while no clicks are '
+                         'being tracked.'),
+        make_option('--parameters', action='store_true', default=False,
+                    help='Also recompute the querystring parameter counters '
+                         'from their daily rollups.'),
+    )
+
+    def handle_noargs(self, **options):
+        fields = ('number_of_registrations',)
+        if options['hits']:
+            fields += ('number_of_hits',)
+            # hits buffered by this process would show as missing; those of
+            # other processes too, which is why clicks mustn't be tracked
+            hit_counter.flush()
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        corrections = reconcile_origins(fields, batch_size, dry_run)
+        if options['parameters']:
+            corrections = chain(corrections, reconcile_parameters(
+                fields, batch_size, dry_run))
+        corrected = 0
+        for correction in corrections:
+            corrected += 1
+            self.stdout.write("%s %s %s: %d -> %d\n" % (
+                correction.model._meta.verbose_name, correction.pk,
+                correction.field, correction.stored, correction.actual))
+        self.stdout.write("%s %d counters\n" % (
+            "Would correct" if dry_run else "Corrected", corrected))
@@ -0,0 +1,17 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from insight.rollups import rollup_registrations
+
+
+class Command(NoArgsCommand):
+    help = "Rolls up new registrations into hourly and daily origin rollups."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type='int', default=1000,
+                    help='The number of registrations rolled up per batch.'),
+    )
+
+    def handle_noargs(self, **options):
+        rolled_up = rollup_registrations(options['batch_size'])
+        self.stdout.write("Rolled up %d registrations\n" % rolled_up)
@@ -0,0 +1,35 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from insight.management.commands.insight_export import parse_date
+from insight.models import Origin
+from insight.visitors import unique_visitors
+
+
+class Command(NoArgsCommand):
+    help = "Estimates the unique visitors of origins from their sketches."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--origin', action='append', dest='codes',
+                    help='The code of an origin to count. Can be repeated.'),
+        make_option('--group', type='int',
+                    help='The id of an origin group to count.'),
+        make_option('--since', help='Count visitors on or after this date '
+                                    '(YYYY-MM-DD).'),
+        make_option('--until', help='Count visitors before this date '
+                                    '(YYYY-MM-DD).'),
+    )
+
+    def handle_noargs(self, **options):
+        filters = {}
+        if options['codes']:
+            filters['origins'] = list(Origin.objects.filter(
+                code__in=options['codes']).values_list('pk', flat=True))
+        if options['group']:
+            filters['group'] = options['group']
+        if options['since']:
+            filters['since'] = parse_date(options['since']).date()
+        if options['until']:
+            filters['until'] = parse_date(options['until']).date()
+        self.stdout.write("About %d unique visitors\n"
+                          % unique_visitors(**filters))
@@ -0,0 +1,13 @@
+from insight.storage import get_storage
+
+
+class TrackingCookieMiddleware(object):
+    """
+    Deletes the tracking cookie once a registration has been tracked. Only
+    needed when `INSIGHT_STORAGE` is 'cookie'.
+    """
+
+    def process_response(self, request, response):
+        if getattr(request, 'insight_clear_cookie', False):
+            response.delete_cookie(get_storage().cookie_name)
+        return response
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'OriginCounterShard'
+        db.create_table(u'insight_origincountershard', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('shard', self.gf('django.db.models.fields.PositiveSmallIntegerField')()),
+            ('number_of_registrations', self.gf('django.db.models.fields.IntegerField')(default=0)),
+            ('origin', self.gf('django.db.models.fields.related.ForeignKey')(related_name='counter_shards', to=orm['insight.Origin'])),
+        ))
+        db.send_create_signal(u'insight', ['OriginCounterShard'])
+
+        # Adding unique constraint on 'OriginCounterShard', fields ['origin', 'shard']
+        db.create_unique(u'insight_origincountershard', ['origin_id', 'shard'])
+
+        # Adding model 'QuerystringParameterCounterShard'
+        db.create_table(u'insight_querystringparametercountershard', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('shard', self.gf('django.db.models.fields.PositiveSmallIntegerField')()),
+            ('number_of_registrations', self.gf('django.db.models.fields.IntegerField')(default=0)),
+            ('parameter', self.gf('django.db.models.fields.related.ForeignKey')(related_name='counter_shards', to=orm['insight.QuerystringParameter'])),
+        ))
+        db.send_create_signal(u'insight', ['QuerystringParameterCounterShard'])
+
+        # Adding unique constraint on 'QuerystringParameterCounterShard', fields ['parameter', 'shard']
+        db.create_unique(u'insight_querystringparametercountershard', ['parameter_id', 'shard'])
+
+
+    def backwards(self, orm):
+        # Removing unique constraint on 'QuerystringParameterCounterShard', fields ['parameter', 'shard']
+        db.delete_unique(u'insight_querystringparametercountershard', ['parameter_id', 'shard'])
+
+        # Removing unique constraint on 'OriginCounterShard', fields ['origin', 'shard']
+        db.delete_unique(u'insight_origincountershard', ['origin_id', 'shard'])
+
+        # Deleting model 'OriginCounterShard'
+        db.delete_table(u'insight_origincountershard')
+
+        # Deleting model 'QuerystringParameterCounterShard'
+        db.delete_table(u'insight_querystringparametercountershard')
+
+
+    models = {
+        u'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': u"orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        u'auth.permission': {
+            'Meta': {'ordering': "(u'content_type__app_label', u'content_type__model', u'codename')", 'unique_together': "((u'content_type', u'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['contenttypes.ContentType']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        u'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': u"orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': u"orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        u'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        u'insight.origin': {
+            'Meta': {'ordering': "['title']", 'object_name': 'Origin'},
+            'code': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'unique': 'True', 'max_length': '7', 'blank': 'True'}),
+            'description': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'number_of_hits': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'number_of_registrations': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'origin_group': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['insight.OriginGroup']", 'null': 'True', 'blank': 'True'}),
+            'querystring_parameters': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'redirect_to': ('django.db.models.fields.URLField', [], {'max_length': '200', 'null': 'True', 'blank': 'True'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'track_registrations': ('django.db.models.fields.BooleanField', [], {'default': 'True'})
+        },
+        u'insight.origincountershard': {
+            'Meta': {'unique_together': "(('origin', 'shard'),)", 'object_name': 'OriginCounterShard'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'number_of_registrations': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'origin': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'counter_shards'", 'to': u"orm['insight.Origin']"}),
+            'shard': ('django.db.models.fields.PositiveSmallIntegerField', [], {})
+        },
+        u'insight.origingroup': {
+            'Meta': {'object_name': 'OriginGroup'},
+            'description': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        u'insight.querystringparameter': {
+            'Meta': {'unique_together': "(('identifier', 'value', 'origin'),)", 'object_name': 'QuerystringParameter'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'identifier': ('django.db.models.fields.CharField', [], {'max_length': '32', 'db_index': 'True'}),
+            'number_of_hits': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'number_of_registrations': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'origin': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['insight.Origin']"}),
+            'value': ('django.db.models.fields.CharField', [], {'max_length': '50', 'db_index': 'True'})
+        },
+        u'insight.querystringparametercountershard': {
+            'Meta': {'unique_together': "(('parameter', 'shard'),)", 'object_name': 'QuerystringParameterCounterShard'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'number_of_registrations': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'parameter': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'counter_shards'", 'to': u"orm['insight.QuerystringParameter']"}),
+            'shard': ('django.db.models.fields.PositiveSmallIntegerField', [], {})
+        },
+        u'insight.registration': {
+            'Meta': {'ordering': "['-created']", 'object_name': 'Registration'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'origin': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['insight.Origin']"}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['auth.User']", 'unique': 'True'})
+        }
+    }
+
+    complete_apps = ['insight']
\ No newline at end of file
@@ -1,10 +1,15 @@
+import json
+import random
 import uuid
 
+from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.contrib.auth.signals import user_logged_in
 from django.dispatch import receiver
-from django.db import models, IntegrityError
-from django.db.models import F
+from django.db import models, connections, transaction, IntegrityError
+from django.db.models import F, Sum
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.utils import timezone
 try:
     from django.contrib.auth import get_user_model
 except ImportError:  # django < 1.5
@@ -12,6 +17,11 @@ except ImportError:  # django < 1.5
 else:
     User = get_user_model()
 
+from insight.cache import invalidate_origin, resolve_origin
+from insight.instrumentation import measure
+from insight.sql import bulk_increment, supports_upsert, upsert_increment
+from insight.storage import get_storage
+
 
 class OriginGroup(models.Model):
     title = models.CharField(max_length=50)
@@ -21,13 +31,69 @@ class OriginGroup(models.Model):
         return self.title
 
 
+def parse_parameters(text):
+    """
+    Returns the querystring parameters listed one per line in `text` as a
+    tuple, without surrounding whitespace, blank lines or duplicates.
+    """
+    params = []
+    for param in (text or '').split("\n"):
+        param = param.strip()
+        if param and param not in params:
+            params.append(param)
+    return tuple(params)
+
+
+def generate_codes(n, length=None, exclude=()):
+    """
+    Returns `n` random codes of `length` (`INSIGHT_CODE_LENGTH` by default)
+    hex digits that no origin has yet and that aren't in `exclude`, checking
+    each batch of candidates against the database with one query.
+    """
+    if length is None:
+        length = getattr(settings, 'INSIGHT_CODE_LENGTH', 7)
+    exclude = set(exclude)
+    codes = set()
+    while len(codes) < n:
+        candidates = set(uuid.uuid4().hex[:length]
+                         for i in range(n - len(codes))) - codes - exclude
+        # IN queries are limited to batches of 500 for SQLite's sake
+        candidates = list(candidates)[:500]
+        taken = set(Origin.objects.filter(code__in=candidates)
+                    .values_list('code', flat=True))
+        codes.update(c for c in candidates if c not in taken)
+    return list(codes)
+
+
+class OriginManager(models.Manager):
+
+    def bulk_create_origins(self, origins, batch_size=100):
+        """
+        Inserts `origins` with `bulk_create`, generating codes for the ones
+        without, in one transaction. Like `bulk_create`, this doesn't call
+        `save` or send the `pre_save` and `post_save` signals.
+        """
+        codeless = [origin for origin in origins if not origin.code]
+        codes = generate_codes(len(codeless), exclude=[
+            origin.code for origin in origins if origin.code])
+        for origin, code in zip(codeless, codes):
+            origin.code = code
+        # a failing batch mustn't leave the earlier ones behind
+        with transaction.commit_on_success(using=self.db):
+            for i in range(0, len(origins), batch_size):
+                self.bulk_create(origins[i:i + batch_size])
+        # the codes may have been cached as unknown
+        for origin in origins:
+            invalidate_origin(origin.code)
+
+
 class Origin(models.Model):
-    title = models.CharField(max_length=50)
+    title = models.CharField(max_length=50, db_index=True)
     description = models.TextField(blank=True, null=True)
     code = models.CharField(
         db_index=True,
         unique=True,
-        max_length=7,
+        max_length=32,
         blank=True,
         help_text="The code that uniquely identifies this origin. "
                   "Leave blank to have it automatically generated."
@@ -40,6 +106,7 @@ class Origin(models.Model):
     )
     track_registrations = models.BooleanField(default=True)
     number_of_registrations = models.IntegerField(editable=False, default=0)
+    number_of_hits = models.IntegerField(editable=False, default=0)
     origin_group = models.ForeignKey(OriginGroup, null=True, blank=True)
     redirect_to = models.URLField(
         blank=True,
@@ -47,20 +114,20 @@ class Origin(models.Model):
         help_text="The URL that this origin's URL will redirect to."
     )
 
+    objects = OriginManager()
+
     class Meta:
         ordering = ['title']
 
     def save(self, *args, **kwargs):
         if not self.code:
             self.code = self.generate_code()
+        self.querystring_parameters = \
+            "\n".join(parse_parameters(self.querystring_parameters)) or None
         super(Origin, self).save(*args, **kwargs)
 
     def generate_code(self):
-        while True:
-            # we expect to have few origin objects, so this is ok
-            cde = uuid.uuid4().hex[:7]
-            if not Origin.objects.filter(code=cde).exists():
-                return cde
+        return generate_codes(1)[0]
 
     def __unicode__(self):
         return self.title
@@ -70,42 +137,150 @@ class Origin(models.Model):
 
     @property
     def parameter_list(self):
-        if self.querystring_parameters:
-            params = self.querystring_parameters.split("\n")
-            return [p.strip() for p in params]
-        return []
+        return list(self._parsed_parameters()[0])
+
+    @property
+    def parameter_set(self):
+        return self._parsed_parameters()[1]
+
+    def _parsed_parameters(self):
+        # parsed once per value of querystring_parameters
+        text = self.querystring_parameters
+        cached = getattr(self, '_parameter_cache', None)
+        if cached is None or cached[0] != text:
+            params = parse_parameters(text)
+            cached = (text, params, frozenset(params))
+            self._parameter_cache = cached
+        return cached[1:]
 
     @staticmethod
     def track(request, user):
-        try:
-            origin = Origin.objects.get(code=request.session['insight_code'])
-            if origin.track_registrations:
-                try:
-                    Registration.objects.create(user=user, origin=origin)
-                    Origin.objects.filter(pk=origin.pk).update(
-                        number_of_registrations=
-                        F('number_of_registrations') + 1
-                    )
-                    for param in origin.parameter_list:
-                        insight_params = request.session['insight_params']
-                        if param in insight_params:
-                            num_updated = QuerystringParameter.objects.filter(
+        stored = get_storage().load(request)
+        if stored is not None:
+            Origin.track_registration(user, *stored)
+
+    @staticmethod
+    def track_registration(user, code, insight_params, touches=None):
+        # the cached fields are all tracking needs, so logins from origins
+        # with tracking switched off don't reach the database
+        with measure('origin_lookup'):
+            origin = resolve_origin(code)
+        if origin is None or not origin['track_registrations']:
+            return
+        origin_pk = origin['pk']
+        # the registration and the counters it increments are committed
+        # together, so reconciling never sees one without the other
+        with transaction.commit_on_success():
+            sid = transaction.savepoint()
+            try:
+                with measure('registration_insert'):
+                    # users whose registration was archived stay registered
+                    if ArchivedUser.objects.filter(user=user).exists():
+                        return
+                    Registration.objects.create(user=user,
+                                                origin_id=origin_pk)
+                transaction.savepoint_commit(sid)
+            except IntegrityError:
+                # the user has already been registered
+                transaction.savepoint_rollback(sid)
+                return
+            sharded = counter_shards() > 0
+            with measure('counter_update'):
+                if sharded:
+                    OriginCounterShard.increment(origin_pk)
+                else:
+                    Origin.objects.filter(pk=origin_pk).update(
+                        number_of_registrations=(
+                            F('number_of_registrations') + 1))
+            from insight.heavyhitters import bucket_counts
+            # the heavy-hitter sketches are only fed in batches
+            tracked = bucket_counts(dict(
+                ((origin_pk, param, value), 1)
+                for param, value in insight_params.items()
+                if param in origin['parameter_set']
+            ), feed=False)
+            with measure('parameter_upsert'):
+                if sharded:
+                    for (pk, param, value), n in tracked.items():
+                        qp, created = (
+                            QuerystringParameter.objects.get_or_create(
                                 identifier=param,
-                                value=insight_params[param],
-                                origin=origin
-                            ).update(number_of_registrations=
-                                     F('number_of_registrations') + 1)
-                            if num_updated == 0:
-                                QuerystringParameter.objects.create(
-                                    identifier=param,
-                                    value=insight_params[param],
-                                    origin=origin,
-                                    number_of_registrations=1
-                                )
-                except IntegrityError:
-                    pass
-        except (Origin.DoesNotExist, KeyError):
-            pass
+                                value=value,
+                                origin_id=origin_pk
+                            ))
+                        QuerystringParameterCounterShard.increment(qp.pk, n)
+                else:
+                    QuerystringParameter.objects.increment(
+                        'number_of_registrations', tracked)
+            if rollups_enabled():
+                from insight.rollups import rollup_parameters
+                rollup_parameters('number_of_registrations', dict(
+                    (key + (timezone.now(),), n) for key, n in tracked.items()
+                ))
+            if touches:
+                from insight.attribution import record_attribution
+                record_attribution([touches])
+
+    @property
+    def total_registrations(self):
+        """
+        The number of registrations including those still held in counter
+        shards.
+        """
+        return total_registrations(self)
+
+
+class QuerystringParameterManager(models.Manager):
+
+    def increment(self, field, counts):
+        """
+        Adds `counts[(origin pk, identifier, value)]` to `field` of each
+        matching querystring parameter, creating the missing ones.
+        """
+        identifier_length = self.model._meta.get_field('identifier').max_length
+        value_length = self.model._meta.get_field('value').max_length
+        truncated = {}
+        for (origin_pk, identifier, value), n in counts.items():
+            key = (origin_pk, identifier[:identifier_length],
+                   value[:value_length])
+            truncated[key] = truncated.get(key, 0) + n
+        if not truncated:
+            return
+        if supports_upsert(connections[self.db]):
+            counters = ('number_of_registrations', 'number_of_hits')
+            upsert_increment(
+                self.model, ('origin', 'identifier', 'value'), counters,
+                [key + tuple(n if c == field else 0 for c in counters)
+                 for key, n in truncated.items()],
+                using=self.db
+            )
+        else:
+            self._increment(field, truncated)
+
+    def _increment(self, field, counts):
+        existing = self.filter(
+            origin__in=set(k[0] for k in counts),
+            identifier__in=set(k[1] for k in counts),
+            value__in=set(k[2] for k in counts)
+        ).values_list('pk', 'origin', 'identifier', 'value')
+        increments = {}
+        for pk, origin_pk, identifier, value in existing:
+            n = counts.pop((origin_pk, identifier, value), 0)
+            if n:
+                increments[pk] = n
+        bulk_increment(self.model, field, increments, using=self.db)
+        for (origin_pk, identifier, value), n in counts.items():
+            sid = transaction.savepoint(using=self.db)
+            try:
+                self.create(origin_id=origin_pk, identifier=identifier,
+                            value=value, **{field: n})
+                transaction.savepoint_commit(sid, using=self.db)
+            except IntegrityError:
+                # created concurrently
+                transaction.savepoint_rollback(sid, using=self.db)
+                self.filter(
+                    origin=origin_pk, identifier=identifier, value=value
+                ).update(**{field: F(field) + n})
 
 
 class QuerystringParameter(models.Model):
@@ -113,27 +288,349 @@ class QuerystringParameter(models.Model):
     value = models.CharField(max_length=50, db_index=True, editable=False)
     origin = models.ForeignKey(Origin, editable=False)
     number_of_registrations = models.IntegerField(default=0, editable=False)
+    number_of_hits = models.IntegerField(default=0, editable=False)
+
+    objects = QuerystringParameterManager()
 
     class Meta:
         unique_together = (('identifier', 'value', 'origin'),)
+        # ranks an origin's values for its funnel
+        index_together = [['origin', 'number_of_registrations']]
+
+    @property
+    def total_registrations(self):
+        """
+        The number of registrations including those still held in counter
+        shards.
+        """
+        return total_registrations(self)
+
+
+class ParameterSketch(models.Model):
+    """
+    The Space-Saving sketch of the values of a querystring parameter of an
+    origin, kept for the parameters in `INSIGHT_HEAVY_HITTER_PARAMETERS`.
+    See `insight.heavyhitters`.
+    """
+    origin = models.ForeignKey(Origin, related_name='parameter_sketches',
+                               editable=False)
+    identifier = models.CharField(max_length=32, editable=False)
+    counters = models.TextField(blank=True, editable=False)
+
+    class Meta:
+        unique_together = (('origin', 'identifier'),)
+
+
+def rollups_enabled():
+    return getattr(settings, 'INSIGHT_ROLLUPS', False)
+
+
+def counter_shards():
+    return getattr(settings, 'INSIGHT_COUNTER_SHARDS', 0)
+
+
+def total_registrations(obj):
+    # querysets annotated with `with_shards` don't need another query
+    if hasattr(obj, 'sharded_registrations'):
+        sharded = obj.sharded_registrations
+    else:
+        sharded = obj.counter_shards.aggregate(
+            n=Sum('number_of_registrations'))['n']
+    return obj.number_of_registrations + (sharded or 0)
+
+
+def with_shards(queryset):
+    """
+    Annotates `queryset` of origins or querystring parameters with the sum of
+    their counter shards.
+    """
+    return queryset.annotate(
+        sharded_registrations=Sum('counter_shards__number_of_registrations'))
+
+
+def with_registrations_total(queryset):
+    """
+    Adds `registrations_total`, the number of registrations including those
+    still held in counter shards, to `queryset` of origins or querystring
+    parameters, e.g. to order by.
+    """
+    model = queryset.model
+    shard_model = model._meta.get_field_by_name('counter_shards')[0].model
+    qn = connections[queryset.db].ops.quote_name
+    sql = ('%(table)s.%(counter)s + COALESCE((SELECT SUM(%(counter)s) '
+           'FROM %(shards)s WHERE %(shards)s.%(fk)s = %(table)s.%(pk)s), 0)'
+           % {
+               'table': qn(model._meta.db_table),
+               'pk': qn(model._meta.pk.column),
+               'counter': qn('number_of_registrations'),
+               'shards': qn(shard_model._meta.db_table),
+               'fk': qn(shard_model._meta.get_field(
+                   shard_model.counted_field).column),
+           })
+    return queryset.extra(select={'registrations_total': sql})
+
+
+class CounterShard(models.Model):
+    """
+    Spreads increments of a registration counter over `INSIGHT_COUNTER_SHARDS`
+    rows so that concurrent registrations don't wait on the same row lock.
+    The shards are folded back into the counter by the `insight_fold_counters`
+    command.
+    """
+    shard = models.PositiveSmallIntegerField(editable=False)
+    number_of_registrations = models.IntegerField(default=0, editable=False)
+
+    # the name of the foreign key to the counted object
+    counted_field = None
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def increment(cls, pk, n=1):
+        lookup = {
+            '%s__pk' % cls.counted_field: pk,
+            'shard': random.randrange(counter_shards()),
+        }
+        updated = cls.objects.filter(**lookup).update(
+            number_of_registrations=F('number_of_registrations') + n)
+        if updated == 0:
+            sid = transaction.savepoint()
+            try:
+                cls.objects.create(**{
+                    '%s_id' % cls.counted_field: pk,
+                    'shard': lookup['shard'],
+                    'number_of_registrations': n,
+                })
+                transaction.savepoint_commit(sid)
+            except IntegrityError:
+                # created concurrently
+                transaction.savepoint_rollback(sid)
+                cls.objects.filter(**lookup).update(
+                    number_of_registrations=F('number_of_registrations') + n)
+
+
+class OriginCounterShard(CounterShard):
+    origin = models.ForeignKey(Origin, related_name='counter_shards',
+                               editable=False)
+
+    counted_field = 'origin'
+
+    class Meta:
+        unique_together = (('origin', 'shard'),)
+
+
+class QuerystringParameterCounterShard(CounterShard):
+    parameter = models.ForeignKey(QuerystringParameter,
+                                  related_name='counter_shards',
+                                  editable=False)
+
+    counted_field = 'parameter'
+
+    class Meta:
+        unique_together = (('parameter', 'shard'),)
 
 
 class Registration(models.Model):
     user = models.ForeignKey(User, unique=True)
     origin = models.ForeignKey(Origin)
-    created = models.DateTimeField(auto_now_add=True)
+    # not auto_now_add so that deferred registrations keep their login time
+    created = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
-        ordering = ['-created']
+        # there's no default ordering, which would sort every query on this
+        # table
+        index_together = [['origin', 'created']]
 
     def __unicode__(self):
         return "%s: %s" % (self.origin.title, unicode(self.user))
 
 
+class RegistrationArchive(models.Model):
+    """
+    The number of registrations of an origin per day that were removed from
+    `Registration` by the `insight_archive_registrations` command.
+    """
+    origin = models.ForeignKey(Origin, related_name='registration_archives',
+                               editable=False)
+    day = models.DateField(editable=False)
+    number_of_registrations = models.IntegerField(default=0, editable=False)
+
+    class Meta:
+        unique_together = (('origin', 'day'),)
+        ordering = ['day']
+
+
+class ArchivedUser(models.Model):
+    """
+    A user whose registration was archived, kept so that they aren't
+    registered again.
+    """
+    user = models.OneToOneField(User, primary_key=True, related_name='+',
+                                editable=False)
+
+
+class PendingRegistration(models.Model):
+    """
+    A login with an origin code that has yet to be tracked, captured when
+    `INSIGHT_DEFERRED_TRACKING` is on. See `insight.tracking`.
+    """
+    user = models.ForeignKey(User)
+    code = models.CharField(max_length=32)
+    params = models.TextField(blank=True)
+    touches = models.TextField(blank=True)
+    created = models.DateTimeField(default=timezone.now)
+
+    @classmethod
+    def capture(cls, user, code, params, touches=None):
+        return cls.objects.create(
+            user=user,
+            code=code,
+            params=json.dumps(dict(params.items())),
+            touches=json.dumps(touches) if touches else ''
+        )
+
+
+class OriginAttribution(models.Model):
+    """
+    Registrations credited to an origin by multi-touch attribution, kept if
+    `INSIGHT_ATTRIBUTION` is on. See `insight.attribution`.
+    """
+    origin = models.OneToOneField(Origin, related_name='attribution',
+                                  editable=False)
+    first_touch = models.IntegerField(default=0, editable=False)
+    last_touch = models.IntegerField(default=0, editable=False)
+    linear = models.FloatField(default=0, editable=False)
+
+
+class Hit(models.Model):
+    """
+    A click on an origin's url, appended by the event log if
+    `INSIGHT_EVENT_LOG` is 'database'. See `insight.events`.
+    """
+    origin = models.ForeignKey(Origin, related_name='hit_events',
+                               editable=False)
+    code = models.CharField(max_length=32, editable=False)
+    created = models.DateTimeField(default=timezone.now, editable=False)
+    params = models.TextField(blank=True, editable=False)
+    referrer = models.CharField(max_length=255, blank=True, editable=False)
+    user_agent_hash = models.CharField(max_length=40, blank=True,
+                                       editable=False)
+
+
+ROLLUP_PERIODS = (
+    ('hour', 'Hourly'),
+    ('day', 'Daily'),
+)
+
+
+class OriginRollup(models.Model):
+    """
+    Registrations and hits of an origin per hour and per day. Registrations
+    are rolled up by the `insight_rollup` command, hits as they are flushed
+    if `INSIGHT_ROLLUPS` is on. See `insight.rollups`.
+    """
+    origin = models.ForeignKey(Origin, related_name='rollups', editable=False)
+    period = models.CharField(max_length=4, choices=ROLLUP_PERIODS,
+                              editable=False)
+    start = models.DateTimeField(editable=False)
+    number_of_registrations = models.IntegerField(default=0, editable=False)
+    number_of_hits = models.IntegerField(default=0, editable=False)
+
+    class Meta:
+        unique_together = (('origin', 'period', 'start'),)
+        ordering = ['start']
+
+
+class QuerystringParameterRollup(models.Model):
+    """
+    Registrations and hits of a querystring parameter value per hour and per
+    day, kept as they are tracked if `INSIGHT_ROLLUPS` is on.
+    """
+    origin = models.ForeignKey(Origin, editable=False)
+    identifier = models.CharField(max_length=32, editable=False)
+    value = models.CharField(max_length=50, editable=False)
+    period = models.CharField(max_length=4, choices=ROLLUP_PERIODS,
+                              editable=False)
+    start = models.DateTimeField(editable=False)
+    number_of_registrations = models.IntegerField(default=0, editable=False)
+    number_of_hits = models.IntegerField(default=0, editable=False)
+
+    class Meta:
+        unique_together = (
+            ('origin', 'identifier', 'value', 'period', 'start'),
+        )
+        ordering = ['start']
+
+
+class VisitorSketch(models.Model):
+    """
+    A HyperLogLog sketch of the visitors of an origin on a day, kept if
+    `INSIGHT_UNIQUE_VISITORS` is on. See `insight.visitors`.
+    """
+    origin = models.ForeignKey(Origin, related_name='visitor_sketches',
+                               editable=False)
+    day = models.DateField(editable=False)
+    registers = models.TextField(editable=False)
+
+    class Meta:
+        unique_together = (('origin', 'day'),)
+
+
+class GroupVisitorSketch(models.Model):
+    """
+    A HyperLogLog sketch of the visitors of the origins in a group on a day,
+    kept alongside their `VisitorSketch` rows. See `insight.visitors`.
+    """
+    origin_group = models.ForeignKey(OriginGroup,
+                                     related_name='visitor_sketches',
+                                     editable=False)
+    day = models.DateField(editable=False)
+    registers = models.TextField(editable=False)
+
+    class Meta:
+        unique_together = (('origin_group', 'day'),)
+
+
+class RollupMark(models.Model):
+    """
+    How far a rollup has got, e.g. the last registration rolled up, and when
+    the mark was last moved if that matters.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    value = models.IntegerField(default=0)
+    updated = models.DateTimeField(null=True, editable=False)
+
+
 @receiver(user_logged_in)
 def record_registration(sender, **kwargs):
     request = kwargs['request']
-    if 'insight_code' in request.session:
-        Origin.track(request, kwargs['user'])
-        del request.session['insight_code']
-        del request.session['insight_params']
+    storage = get_storage()
+    stored = storage.load(request)
+    if stored is not None:
+        touches = storage.touches(request)
+        if getattr(settings, 'INSIGHT_DEFERRED_TRACKING', False):
+            origin = resolve_origin(stored[0])
+            if origin is not None and origin['track_registrations']:
+                PendingRegistration.capture(kwargs['user'], *stored,
+                                            touches=touches)
+        else:
+            Origin.track_registration(kwargs['user'], *stored,
+                                      touches=touches)
+        storage.clear(request)
+
+
+@receiver(pre_save, sender=Origin)
+def invalidate_previous_code(sender, instance, **kwargs):
+    # the cached entry for the old code would outlive a code change
+    if instance.pk is not None:
+        old_codes = Origin.objects.filter(pk=instance.pk).exclude(
+            code=instance.code).values_list('code', flat=True)
+        for code in old_codes:
+            invalidate_origin(code)
+
+
+@receiver(post_save, sender=Origin)
+@receiver(post_delete, sender=Origin)
+def invalidate_cached_origin(sender, instance, **kwargs):
+    invalidate_origin(instance.code)
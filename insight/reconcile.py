@@ -0,0 +1,148 @@
+"""
+Reconciliation of the denormalized counters with the rows they count.
+
+Origin registration counters are recomputed from `Registration` and
+`RegistrationArchive`, origin hit counters from the `Hit` event log, and
+querystring parameter counters from the daily `QuerystringParameterRollup`
+rows. The latter two are only complete
+if `INSIGHT_EVENT_LOG` respectively `INSIGHT_ROLLUPS` have been on all along.
+
+Counters are compared a batch of rows at a time, locked with
+``SELECT ... FOR UPDATE`` while their counts are read and corrected, and
+corrections are added with `bulk_increment` rather than overwriting the
+counters. A registration is committed together with the counters it
+increments, so registration counters can be reconciled while logins are
+tracked: a concurrent registration is either waited for or not seen at all.
+Hits are different, they're counted in buffers before they're logged or
+written, so hit counters read in between would be corrected and then
+incremented again. Only reconcile those while no clicks are tracked.
+"""
+from collections import namedtuple
+
+from django.db import router, transaction
+from django.db.models import Count, Sum
+
+from insight.models import (Origin, QuerystringParameter, Registration, Hit,
+                            OriginCounterShard,
+                            QuerystringParameterCounterShard,
+                            QuerystringParameterRollup, RegistrationArchive)
+from insight.sql import bulk_increment
+
+
+Correction = namedtuple('Correction', 'model pk field stored actual')
+
+
+def pk_batches(queryset, batch_size):
+    last_pk = None
+    queryset = queryset.order_by('pk')
+    while True:
+        batch = queryset
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        pks = list(batch.values_list('pk', flat=True)[:batch_size])
+        if pks:
+            yield pks
+        if len(pks) < batch_size:
+            return
+        last_pk = pks[-1]
+
+
+def primary(model):
+    # counts can't be read from a lagging replica
+    return model.objects.using(router.db_for_write(model))
+
+
+def origin_counts(pks, fields):
+    counts = dict((pk, dict.fromkeys(fields, 0)) for pk in pks)
+    for field, model in (('number_of_registrations', Registration),
+                         ('number_of_hits', Hit)):
+        if field in fields:
+            grouped = primary(model).filter(origin__in=pks).order_by() \
+                .values_list('origin').annotate(n=Count('pk'))
+            for origin_pk, n in grouped:
+                counts[origin_pk][field] = n
+    if 'number_of_registrations' in fields:
+        archived = primary(RegistrationArchive).filter(origin__in=pks) \
+            .order_by().values_list('origin') \
+            .annotate(n=Sum('number_of_registrations'))
+        for origin_pk, n in archived:
+            counts[origin_pk]['number_of_registrations'] += n
+    return counts
+
+
+def parameter_counts(pks, fields):
+    keys = dict(
+        ((origin_pk, identifier, value), pk)
+        for pk, origin_pk, identifier, value in
+        QuerystringParameter.objects.filter(pk__in=pks).values_list(
+            'pk', 'origin', 'identifier', 'value')
+    )
+    counts = dict((pk, dict.fromkeys(fields, 0)) for pk in pks)
+    rollups = primary(QuerystringParameterRollup).filter(
+        period='day',
+        origin__in=set(key[0] for key in keys),
+        identifier__in=set(key[1] for key in keys)
+    ).order_by().values_list('origin', 'identifier', 'value').annotate(
+        *[Sum(field) for field in fields])
+    for row in rollups:
+        pk = keys.get(row[:3])
+        if pk is not None:
+            counts[pk] = dict(zip(fields, (n or 0 for n in row[3:])))
+    return counts
+
+
+@transaction.commit_on_success
+def reconcile_batch(model, shard_model, pks, fields, count, dry_run=False):
+    """
+    Returns the corrections of `fields` of the `model` rows with `pks`, as
+    recomputed by `count(pks, fields)`, and applies them unless `dry_run`.
+    """
+    stored = dict(
+        (row[0], dict(zip(fields, row[1:])))
+        for row in model.objects.select_for_update().filter(pk__in=pks)
+        .values_list('pk', *fields)
+    )
+    if 'number_of_registrations' in fields:
+        # registrations still held in shards are part of the count
+        shards = shard_model.objects.select_for_update().filter(**{
+            '%s__in' % shard_model.counted_field: pks
+        }).values_list(shard_model.counted_field, 'number_of_registrations')
+        for pk, n in shards:
+            stored[pk]['number_of_registrations'] += n
+    counts = count(list(stored), fields)
+    corrections = []
+    for field in fields:
+        deltas = {}
+        for pk in sorted(stored):
+            actual = counts[pk][field]
+            if stored[pk][field] != actual:
+                corrections.append(Correction(model, pk, field,
+                                              stored[pk][field], actual))
+                deltas[pk] = actual - stored[pk][field]
+        if not dry_run:
+            bulk_increment(model, field, deltas)
+    return corrections
+
+
+def reconcile_origins(fields=('number_of_registrations',), batch_size=500,
+                      dry_run=False):
+    """
+    Yields the corrections of the origin counters in `fields`.
+    """
+    for pks in pk_batches(Origin.objects.all(), batch_size):
+        for correction in reconcile_batch(Origin, OriginCounterShard, pks,
+                                          fields, origin_counts, dry_run):
+            yield correction
+
+
+def reconcile_parameters(fields=('number_of_registrations',), batch_size=500,
+                         dry_run=False):
+    """
+    Yields the corrections of the querystring parameter counters in
+    `fields`.
+    """
+    for pks in pk_batches(QuerystringParameter.objects.all(), batch_size):
+        for correction in reconcile_batch(
+                QuerystringParameter, QuerystringParameterCounterShard, pks,
+                fields, parameter_counts, dry_run):
+            yield correction
@@ -0,0 +1,77 @@
+"""
+Archival of old registrations.
+
+Registrations older than the retention period are removed from
+`Registration` in batches and counted per origin and day in
+`RegistrationArchive`, so the table and its indexes only hold recent rows.
+Only registrations already rolled up by `insight_rollup` are archived, which
+keeps the rollups the admin stats are based on complete.
+
+The ids of archived users are kept in `ArchivedUser`, which tracking checks
+so that a user whose registration was archived isn't registered again.
+"""
+import datetime
+from collections import Counter
+
+from django.db import transaction
+from django.utils import timezone
+
+from insight.models import (ArchivedUser, Registration, RegistrationArchive,
+                            RollupMark)
+from insight.rollups import REGISTRATIONS_MARK
+from insight.sql import upsert_increment
+
+
+def archive_counts(counts):
+    """
+    Adds `counts[(origin pk, day)]` to the archived registrations.
+    """
+    upsert_increment(
+        RegistrationArchive, ('origin', 'day'), ('number_of_registrations',),
+        [key + (n,) for key, n in counts.items()]
+    )
+
+
+def archivable(days):
+    """
+    Returns the registrations older than `days` days that have been rolled
+    up.
+    """
+    until = timezone.now() - datetime.timedelta(days=days)
+    try:
+        rolled_up = RollupMark.objects.get(name=REGISTRATIONS_MARK).value
+    except RollupMark.DoesNotExist:
+        rolled_up = 0
+    return Registration.objects.filter(created__lt=until, pk__lte=rolled_up)
+
+
+@transaction.commit_on_success
+def archive_batch(days, batch_size=1000):
+    """
+    Archives the next `batch_size` registrations older than `days` days and
+    returns how many were archived.
+    """
+    registrations = list(archivable(days).order_by('pk').values_list(
+        'pk', 'user', 'origin', 'created')[:batch_size])
+    if not registrations:
+        return 0
+    counts = Counter()
+    for pk, user_pk, origin_pk, created in registrations:
+        counts[(origin_pk, created.date())] += 1
+    archive_counts(counts)
+    ArchivedUser.objects.bulk_create([
+        ArchivedUser(user_id=user_pk)
+        for pk, user_pk, origin_pk, created in registrations
+    ])
+    Registration.objects.filter(
+        pk__in=[registration[0] for registration in registrations]).delete()
+    return len(registrations)
+
+
+def archive_registrations(days, batch_size=1000):
+    total = 0
+    while True:
+        archived = archive_batch(days, batch_size)
+        if not archived:
+            return total
+        total += archived
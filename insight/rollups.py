@@ -0,0 +1,128 @@
+"""
+Hourly and daily rollups of registrations and hits.
+
+Registrations per origin are rolled up from a high-water mark on
+`Registration` by `rollup_registrations`, which the `insight_rollup` command
+runs. Querystring parameters aren't kept per registration, so with
+`INSIGHT_ROLLUPS` on their rollups are written as registrations are tracked,
+and the rollups of hits as hits are flushed.
+"""
+import datetime
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from insight.models import (OriginRollup, QuerystringParameterRollup,
+                            Registration, RollupMark)
+from insight.sql import upsert_increment
+
+
+REGISTRATIONS_MARK = 'registrations'
+# the highest registration id when the rollup last caught up
+SEEN_MARK = 'registrations-seen'
+
+
+def bucket_starts(dt):
+    """
+    Returns the (period, start) of the hour and day `dt` falls in.
+    """
+    hour = dt.replace(minute=0, second=0, microsecond=0)
+    return [('hour', hour), ('day', hour.replace(hour=0))]
+
+
+def increment_rollups(model, key_fields, field, counts):
+    """
+    Adds `counts[key + (dt,)]` to `field` of the hourly and daily rollups of
+    `model` for `dt`, where `key` holds the values of `key_fields`.
+    """
+    rollups = Counter()
+    for key, n in counts.items():
+        for period, start in bucket_starts(key[-1]):
+            rollups[key[:-1] + (period, start)] += n
+    if not rollups:
+        return
+    counters = ('number_of_registrations', 'number_of_hits')
+    key_fields = tuple(key_fields) + ('period', 'start')
+    upsert_increment(
+        model, key_fields, counters,
+        [key + tuple(n if c == field else 0 for c in counters)
+         for key, n in rollups.items()]
+    )
+
+
+def rollup_origins(field, counts):
+    """
+    Adds `counts[(origin pk, datetime)]` to `field` of the origin rollups.
+    """
+    increment_rollups(OriginRollup, ('origin',), field, counts)
+
+
+def rollup_parameters(field, counts):
+    """
+    Adds `counts[(origin pk, identifier, value, datetime)]` to `field` of the
+    querystring parameter rollups.
+    """
+    max_length = QuerystringParameterRollup._meta.get_field('value') \
+        .max_length
+    truncated = Counter()
+    for (origin_pk, identifier, value, dt), n in counts.items():
+        truncated[(origin_pk, identifier, value[:max_length], dt)] += n
+    increment_rollups(QuerystringParameterRollup,
+                      ('origin', 'identifier', 'value'), field, truncated)
+
+
+@transaction.commit_on_success
+def rollup_registration_batch(batch_size=1000):
+    """
+    Rolls up the next `batch_size` registrations after the high-water mark
+    and returns how many were rolled up.
+
+    Ids are assigned when rows are inserted, not when they are committed,
+    so a registration may become visible after one with a higher id has
+    been rolled up. Registrations are therefore only rolled up to the
+    highest id seen at least `INSIGHT_ROLLUP_LAG` seconds before, and are
+    counted in the hour and day they were created in, which for deferred
+    registrations may be well before they were inserted.
+    """
+    mark, created = RollupMark.objects.select_for_update() \
+        .get_or_create(name=REGISTRATIONS_MARK)
+    seen, created = RollupMark.objects.select_for_update() \
+        .get_or_create(name=SEEN_MARK)
+    now = timezone.now()
+    if mark.value >= seen.value:
+        seen.value = Registration.objects.aggregate(
+            last=Max('pk'))['last'] or 0
+        seen.updated = now
+        seen.save()
+    lag = getattr(settings, 'INSIGHT_ROLLUP_LAG', 60)
+    if seen.updated > now - datetime.timedelta(seconds=lag):
+        return 0
+    registrations = Registration.objects.filter(
+        pk__gt=mark.value, pk__lte=seen.value
+    ).order_by('pk').values_list('pk', 'origin', 'created')[:batch_size]
+    counts = Counter()
+    last_pk = None
+    for pk, origin_pk, created in registrations:
+        counts[(origin_pk, created)] += 1
+        last_pk = pk
+    if last_pk is None:
+        # the registrations between the marks have since been deleted
+        mark.value = seen.value
+        mark.save()
+        return 0
+    rollup_origins('number_of_registrations', counts)
+    mark.value = last_pk
+    mark.save()
+    return sum(counts.values())
+
+
+def rollup_registrations(batch_size=1000):
+    total = 0
+    while True:
+        rolled_up = rollup_registration_batch(batch_size)
+        if not rolled_up:
+            return total
+        total += rolled_up
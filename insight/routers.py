@@ -0,0 +1,28 @@
+"""
+Routing of insight's reporting reads to a replica.
+
+With `INSIGHT_REPORTING_DATABASE` set to a database alias, the admin stats
+view, the admin changelists, funnels, unique visitor counts and exports read
+from that database through `reporting`.
+
+Only those queries are routed. insight has no database router, since a
+router only sees the model: the rollup, archive and attribution models are
+also read by the `get_or_create` calls that increment them, which have to
+read the primary. Tracking, and anything that reads before it writes, stays
+on the primary.
+"""
+from django.conf import settings
+
+
+def reporting_database():
+    return getattr(settings, 'INSIGHT_REPORTING_DATABASE', None)
+
+
+def reporting(queryset):
+    """
+    Returns `queryset` reading from the reporting database, if there is one.
+    """
+    alias = reporting_database()
+    if alias is None:
+        return queryset
+    return queryset.using(alias)
@@ -1,5 +1,11 @@
 from django.dispatch import Signal
 
 
-# allow other apps to track hits for this url
-origin_hit = Signal(providing_args=['instance', 'request'])
+# allow other apps to track hits for this url; `repeat` is true for repeated
+# clicks by the same visitor, see insight.dedupe
+origin_hit = Signal(providing_args=['instance', 'request', 'repeat'])
+
+# sent with the duration and number of queries of instrumented operations
+# when INSIGHT_INSTRUMENTATION is on
+operation_measured = Signal(providing_args=['operation', 'duration',
+                                            'queries'])
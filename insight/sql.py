@@ -0,0 +1,120 @@
+"""
+Helpers for writes that the ORM can't batch.
+"""
+from django.db import connections, router, transaction
+from django.db.models import F
+
+
+# keeps the number of parameters per statement below SQLite's limit of 999
+BATCH_SIZE = 300
+
+
+def bulk_increment(model, field, increments, using=None):
+    """
+    Adds `increments[pk]` to `field` of each row of `model`, using one
+    ``UPDATE ... CASE`` statement per batch of rows.
+    """
+    increments = [(pk, n) for pk, n in increments.items() if n]
+    if not increments:
+        return
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    column = qn(model._meta.get_field(field).column)
+    pk_column = qn(model._meta.pk.column)
+    cursor = connection.cursor()
+    for i in range(0, len(increments), BATCH_SIZE):
+        batch = increments[i:i + BATCH_SIZE]
+        params = []
+        for pk, n in batch:
+            params.extend((pk, n))
+        params.extend(pk for pk, n in batch)
+        cursor.execute(
+            "UPDATE %s SET %s = %s + CASE %s %s ELSE 0 END "
+            "WHERE %s IN (%s)" % (
+                table, column, column, pk_column,
+                " ".join(["WHEN %s THEN %s"] * len(batch)),
+                pk_column, ", ".join(["%s"] * len(batch))
+            ),
+            params
+        )
+    transaction.commit_unless_managed(using=using)
+
+
+def supports_upsert(connection):
+    if connection.vendor in ('postgresql', 'mysql'):
+        return True
+    if connection.vendor == 'sqlite':
+        from django.db.backends.sqlite3.base import Database
+        # ON CONFLICT ... DO UPDATE was added in SQLite 3.24
+        return Database.sqlite_version_info >= (3, 24, 0)
+    return False
+
+
+def upsert_increment(model, key_fields, fields, rows, using=None):
+    """
+    Inserts a row of `model` per item of `rows`, or adds to the existing row
+    with the same values for `key_fields`, which need to be unique together.
+    Each item of `rows` holds the values of `key_fields` followed by the
+    amounts added to `fields`.
+
+    Rows are written with one ``INSERT ... ON CONFLICT DO UPDATE`` (or ``ON
+    DUPLICATE KEY UPDATE`` on MySQL) statement per batch if the connection
+    `supports_upsert`, and with `get_or_create_increment` otherwise.
+    """
+    if not rows:
+        return
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    if not supports_upsert(connection):
+        get_or_create_increment(model, key_fields, fields, rows, using)
+        return
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    key_columns = [qn(model._meta.get_field(f).column) for f in key_fields]
+    columns = [qn(model._meta.get_field(f).column) for f in fields]
+    if connection.vendor == 'mysql':
+        conflict = "ON DUPLICATE KEY UPDATE %s" % ", ".join(
+            "%s = %s + VALUES(%s)" % (c, c, c) for c in columns)
+    else:
+        conflict = "ON CONFLICT (%s) DO UPDATE SET %s" % (
+            ", ".join(key_columns),
+            ", ".join("%s = %s.%s + EXCLUDED.%s" % (c, table, c, c)
+                      for c in columns))
+    placeholder = "(%s)" % ", ".join(["%s"] * (len(key_columns) +
+                                               len(columns)))
+    # a consistent order avoids deadlocks between concurrent upserts
+    rows = sorted(rows)
+    batch_size = max(1, 900 // (len(key_columns) + len(columns)))
+    cursor = connection.cursor()
+    for i in range(0, len(rows), batch_size):
+        batch = rows[i:i + batch_size]
+        params = []
+        for row in batch:
+            params.extend(row)
+        cursor.execute(
+            "INSERT INTO %s (%s) VALUES %s %s" % (
+                table, ", ".join(key_columns + columns),
+                ", ".join([placeholder] * len(batch)), conflict
+            ),
+            params
+        )
+    transaction.commit_unless_managed(using=using)
+
+
+def get_or_create_increment(model, key_fields, fields, rows, using):
+    """
+    Writes `rows` like `upsert_increment` with a `get_or_create` and an
+    ``UPDATE`` per row, for databases without upserts.
+    """
+    manager = model._default_manager.db_manager(using)
+    # foreign keys are given as pks
+    names = [model._meta.get_field(f).attname for f in key_fields]
+    for row in sorted(rows):
+        obj, created = manager.get_or_create(
+            **dict(zip(names, row[:len(names)])))
+        # added in the database, so concurrent writes don't lose counts
+        manager.filter(pk=obj.pk).update(**dict(
+            (f, F(f) + n) for f, n in zip(fields, row[len(names):]) if n))
+    transaction.commit_unless_managed(using=using)
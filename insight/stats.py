@@ -0,0 +1,122 @@
+"""
+Registration totals, shares and growth per origin and origin group, as shown
+on the admin stats view.
+
+Everything is computed with a fixed number of aggregate queries, with growth
+read from the daily `OriginRollup` rows and attributed registrations from
+`OriginAttribution`, read from `INSIGHT_REPORTING_DATABASE` if set, and
+cached for `INSIGHT_STATS_CACHE_TIMEOUT` seconds.
+"""
+import datetime
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.db.models import Sum
+from django.utils import timezone
+
+from insight.attribution import attribution_enabled
+from insight.models import (Origin, OriginAttribution, OriginGroup,
+                            OriginRollup, with_shards)
+from insight.routers import reporting
+
+
+def percentage(part, whole):
+    if not whole:
+        return None
+    return 100.0 * part / whole
+
+
+def rolled_up_registrations(since, until=None):
+    """
+    Returns the registrations per origin pk in the daily rollups starting
+    from `since` and before `until`.
+    """
+    rollups = reporting(OriginRollup.objects.filter(period='day',
+                                                    start__gte=since))
+    if until is not None:
+        rollups = rollups.filter(start__lt=until)
+    return dict(rollups.values_list('origin').order_by()
+                .annotate(n=Sum('number_of_registrations')))
+
+
+def compute_stats(days):
+    today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    since = today - datetime.timedelta(days=days - 1)
+    current = rolled_up_registrations(since)
+    previous = rolled_up_registrations(
+        since - datetime.timedelta(days=days), since)
+    attribution = attribution_enabled()
+    credits = {}
+    if attribution:
+        credits = dict(
+            (row[0], row[1:])
+            for row in reporting(OriginAttribution.objects.all())
+            .values_list('origin', 'first_touch', 'last_touch', 'linear'))
+
+    origins = []
+    counted = ('registrations', 'hits', 'window', 'previous_window',
+               'first_touch', 'last_touch', 'linear')
+    groups = dict(
+        (pk, dict(dict.fromkeys(counted, 0), title=title, origins=0))
+        for pk, title in reporting(OriginGroup.objects.all())
+        .values_list('pk', 'title')
+    )
+    ungrouped = dict(dict.fromkeys(counted, 0), title='(no group)',
+                     origins=0)
+    for row in with_shards(reporting(Origin.objects.order_by())).values(
+            'pk', 'title', 'code', 'origin_group', 'number_of_registrations',
+            'sharded_registrations', 'number_of_hits'):
+        origin = {
+            'pk': row['pk'],
+            'title': row['title'],
+            'code': row['code'],
+            'registrations': (row['number_of_registrations'] +
+                              (row['sharded_registrations'] or 0)),
+            'hits': row['number_of_hits'],
+            'window': current.get(row['pk'], 0),
+            'previous_window': previous.get(row['pk'], 0),
+        }
+        origin.update(zip(('first_touch', 'last_touch', 'linear'),
+                          credits.get(row['pk'], (0, 0, 0))))
+        origins.append(origin)
+        group = groups.get(row['origin_group'], ungrouped)
+        group['origins'] += 1
+        for key in counted:
+            group[key] += origin[key]
+
+    groups = list(groups.values())
+    if ungrouped['origins']:
+        groups.append(ungrouped)
+    total = sum(o['registrations'] for o in origins)
+    window_total = sum(o['window'] for o in origins)
+    for row in origins + groups:
+        row['share'] = percentage(row['registrations'], total)
+        row['window_share'] = percentage(row['window'], window_total)
+        if row['previous_window']:
+            row['growth'] = percentage(
+                row['window'] - row['previous_window'],
+                row['previous_window'])
+        else:
+            row['growth'] = None
+    origins.sort(key=lambda o: o['registrations'], reverse=True)
+    groups.sort(key=lambda g: g['registrations'], reverse=True)
+    return {
+        'days': days,
+        'since': since,
+        'total': total,
+        'window_total': window_total,
+        'attribution': attribution,
+        'origins': origins,
+        'groups': groups,
+    }
+
+
+def get_stats(days):
+    cache = get_cache(getattr(settings, 'INSIGHT_CACHE_ALIAS', 'default'))
+    key = 'insight:stats:%d' % days
+    stats = cache.get(key)
+    if stats is None:
+        stats = compute_stats(days)
+        cache.set(key, stats,
+                  getattr(settings, 'INSIGHT_STATS_CACHE_TIMEOUT', 60))
+    return stats
@@ -0,0 +1,116 @@
+"""
+Where the origin code and tracked querystring parameters of a click are kept
+until the visitor logs in.
+
+`INSIGHT_STORAGE` selects either the session (the default) or a signed cookie.
+The cookie costs no server-side writes per click, but needs
+`insight.middleware.TrackingCookieMiddleware` to remove it once the
+registration has been tracked.
+"""
+import json
+
+from django.conf import settings
+
+from insight.attribution import add_touch, attribution_enabled
+
+
+def filter_params(query, parameter_list):
+    """
+    Returns a dict of the parameters in `parameter_list` found in `query`,
+    with values cut to `INSIGHT_PARAM_MAX_LENGTH` characters. This is all
+    that's kept of a click's query string.
+    """
+    max_length = getattr(settings, 'INSIGHT_PARAM_MAX_LENGTH', 50)
+    return dict(
+        (p, unicode(query[p])[:max_length])
+        for p in parameter_list if p in query
+    )
+
+
+class SessionStorage(object):
+
+    def save(self, request, response, code, params):
+        request.session['insight_code'] = code
+        request.session['insight_params'] = params
+        if attribution_enabled():
+            request.session['insight_touches'] = add_touch(
+                self.touches(request), code)
+
+    def load(self, request):
+        """
+        Returns the stored (code, params) or `None`.
+        """
+        if 'insight_code' in request.session:
+            return (request.session['insight_code'],
+                    request.session.get('insight_params') or {})
+        return None
+
+    def touches(self, request):
+        """
+        Returns the stored touches, see `insight.attribution`.
+        """
+        return request.session.get('insight_touches') or []
+
+    def clear(self, request):
+        request.session.pop('insight_code', None)
+        request.session.pop('insight_params', None)
+        request.session.pop('insight_touches', None)
+
+
+class CookieStorage(object):
+    salt = 'insight'
+
+    @property
+    def cookie_name(self):
+        return getattr(settings, 'INSIGHT_COOKIE_NAME', 'insight')
+
+    @property
+    def max_age(self):
+        return getattr(settings, 'INSIGHT_COOKIE_AGE', 60 * 60 * 24 * 30)
+
+    def save(self, request, response, code, params):
+        payload = [code, params]
+        if attribution_enabled():
+            payload.append(add_touch(self.touches(request), code))
+        value = json.dumps(payload, separators=(',', ':'))
+        response.set_signed_cookie(
+            self.cookie_name, value, salt=self.salt, max_age=self.max_age,
+            httponly=True
+        )
+
+    def load_payload(self, request):
+        value = request.get_signed_cookie(
+            self.cookie_name, default=None, salt=self.salt,
+            max_age=self.max_age
+        )
+        if value is None:
+            return None
+        try:
+            payload = json.loads(value)
+        except ValueError:
+            return None
+        if not isinstance(payload, list) or len(payload) < 2:
+            return None
+        return payload
+
+    def load(self, request):
+        payload = self.load_payload(request)
+        if payload is None:
+            return None
+        return payload[0], payload[1]
+
+    def touches(self, request):
+        payload = self.load_payload(request)
+        if payload is None or len(payload) < 3:
+            return []
+        return payload[2]
+
+    def clear(self, request):
+        # the cookie is deleted by TrackingCookieMiddleware
+        request.insight_clear_cookie = True
+
+
+def get_storage():
+    if getattr(settings, 'INSIGHT_STORAGE', 'session') == 'cookie':
+        return CookieStorage()
+    return SessionStorage()
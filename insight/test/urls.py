@@ -1,9 +1,13 @@
 from django.conf.urls.defaults import patterns, url, include
+from django.contrib import admin
 from django.http import HttpResponse
 
 from insight.urls import urlpatterns as insight_urls
 
 
+admin.autodiscover()
+
+
 def view_stub(request):
     return HttpResponse()
 
@@ -15,5 +19,6 @@ urlpatterns = patterns(
         view_stub,
         name='stub'
     ),
+    url(r'^admin/', include(admin.site.urls)),
     url(r'', include('django.contrib.auth.urls')),
 ) + insight_urls
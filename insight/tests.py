@@ -1,8 +1,19 @@
+import datetime
+import json
+import os
+import tempfile
 import unittest
+from StringIO import StringIO
 
 from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
 from django.conf import settings
+from django.core.management import call_command
+from django.contrib.sites.models import Site
 from django.core.urlresolvers import reverse
+from django.db import DatabaseError
+from django.utils import timezone
 try:
     from django.contrib.auth import get_user_model
 except ImportError:  # django < 1.5
@@ -10,8 +21,27 @@ except ImportError:  # django < 1.5
 else:
     User = get_user_model()
 
-from insight.models import (Origin, Registration,
-                            QuerystringParameter)
+from insight.attribution import add_touch
+from insight.cache import resolver, resolve_origin
+from insight.dedupe import deduplicator
+from insight.events import EventRecorder, recorder
+from insight.heavyhitters import OTHER, SpaceSaving
+from insight.hits import hit_counter
+from insight.hyperloglog import HyperLogLog
+from insight.instrumentation import NOOP, aggregator, measure
+from insight.export import export_lines
+from insight.models import (Origin, OriginGroup, Registration, Hit,
+                            QuerystringParameter, OriginCounterShard,
+                            PendingRegistration, OriginRollup,
+                            QuerystringParameterRollup, RegistrationArchive,
+                            OriginAttribution, ParameterSketch,
+                            RollupMark, VisitorSketch, GroupVisitorSketch,
+                            generate_codes, with_shards)
+from insight.rollups import SEEN_MARK, rollup_registrations
+from insight.signals import origin_hit, operation_measured
+from insight.sql import upsert_increment
+from insight.stats import compute_stats
+from insight.visitors import unique_visitors, visitor_counter
 
 
 def create_origin(title='test_origin'):
@@ -106,6 +136,30 @@ class AuthUserTestCase(TestCase):
                                                           value=444)
                          .number_of_registrations, 1)
 
+    @override_settings(INSIGHT_PARAM_MAX_LENGTH=5)
+    def test_only_tracked_params_are_stored(self):
+        origin = create_origin()
+        origin.querystring_parameters = "pid\noid"
+        origin.save()
+        self.client.get(origin.get_absolute_url(),
+                        data={'pid': '1234567', 'kid': '00'})
+        self.assertEqual(self.client.session['insight_params'],
+                         {'pid': '12345'})
+
+    def test_parameter_list_is_normalized(self):
+        origin = create_origin()
+        origin.querystring_parameters = " pid \n\noid\r\npid\n"
+        self.assertEqual(origin.parameter_list, ['pid', 'oid'])
+        self.assertEqual(origin.parameter_set, frozenset(['pid', 'oid']))
+        origin.save()
+        self.assertEqual(Origin.objects.get(pk=origin.pk)
+                         .querystring_parameters, "pid\noid")
+        origin.querystring_parameters = "gid"
+        self.assertEqual(origin.parameter_list, ['gid'])
+        origin.querystring_parameters = "\n"
+        origin.save()
+        self.assertEqual(origin.querystring_parameters, None)
+
     def test_redirect(self):
         origin1 = create_origin()
         origin2 = create_origin()
@@ -138,5 +192,1131 @@ class AuthUserTestCase(TestCase):
 
         self.assertTrue(signal_dict['signal_received'])
         self.assertEqual(origin, signal_dict['instance'])
+        # receivers get the whole origin
+        self.assertEqual(signal_dict['instance'].title, origin.title)
         self.assertEqual(signal_dict['request'].path,
                          origin.get_absolute_url())
+
+
+class OriginCacheTestCase(TestCase):
+    urls = 'insight.test.urls'
+
+    def setUp(self):
+        resolver.clear()
+        resolver.shared.clear()
+
+    def test_lookup_is_cached(self):
+        origin = create_origin()
+        origin.querystring_parameters = "pid"
+        origin.save()
+        self.assertEqual(resolve_origin(origin.code)['parameter_list'],
+                         ['pid'])
+        with self.assertNumQueries(0):
+            data = resolve_origin(origin.code)
+        self.assertEqual(data['pk'], origin.pk)
+        resolver.clear()
+        with self.assertNumQueries(0):
+            resolve_origin(origin.code)
+
+    def test_unknown_code_is_cached(self):
+        self.assertEqual(resolve_origin('abc'), None)
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_origin('abc'), None)
+        origin = Origin(title='test_origin', code='abc')
+        origin.save()
+        self.assertEqual(resolve_origin('abc')['pk'], origin.pk)
+
+    def test_cache_invalidated_on_change(self):
+        origin = create_origin()
+        resolve_origin(origin.code)
+        origin.redirect_to = 'http://example.com/'
+        origin.save()
+        self.assertEqual(resolve_origin(origin.code)['redirect_to'],
+                         'http://example.com/')
+        old_code = origin.code
+        origin.code = 'newcode'
+        origin.save()
+        self.assertEqual(resolve_origin(old_code), None)
+        origin.delete()
+        self.assertEqual(resolve_origin('newcode'), None)
+
+    def test_tracking_uses_cached_origin(self):
+        origin = create_origin()
+        untracked = Origin(title='untracked', track_registrations=False)
+        untracked.save()
+        self.client.get(origin.get_absolute_url())
+        self.client.get(untracked.get_absolute_url())
+        user = create_user('username', 'password')
+        with self.assertNumQueries(0):
+            Origin.track_registration(user, untracked.code, {})
+        # the archived user check, the insert and the counter update
+        with self.assertNumQueries(3):
+            Origin.track_registration(user, origin.code, {})
+        self.assertEqual(Registration.objects.get(user=user).origin, origin)
+
+
+@override_settings(INSIGHT_HIT_FLUSH_INTERVAL=3600)
+class HitCounterTestCase(TestCase):
+    urls = 'insight.test.urls'
+
+    def setUp(self):
+        hit_counter.collect()
+
+    def assertHits(self, origin, hits, **params):
+        self.assertEqual(Origin.objects.get(pk=origin.pk).number_of_hits,
+                         hits)
+        for identifier, (value, param_hits) in params.items():
+            self.assertEqual(QuerystringParameter.objects.get(
+                origin=origin, identifier=identifier, value=value
+            ).number_of_hits, param_hits)
+
+    def test_failed_flush_drops_hits(self):
+        import insight.hits
+        origin = create_origin()
+        self.client.get(origin.get_absolute_url())
+        dropped = hit_counter.dropped
+        write_hits = insight.hits.write_hits
+
+        def failing_write_hits(counts):
+            raise DatabaseError
+
+        insight.hits.write_hits = failing_write_hits
+        try:
+            with override_settings(INSIGHT_HIT_FLUSH_INTERVAL=0):
+                response = self.client.get(origin.get_absolute_url())
+        finally:
+            insight.hits.write_hits = write_hits
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(hit_counter.dropped, dropped + 2)
+
+    def click_and_flush(self, origin):
+        origin.querystring_parameters = "pid\noid"
+        origin.save()
+        for i in range(3):
+            self.client.get(origin.get_absolute_url(),
+                            data={'pid': 1, 'kid': 2})
+        self.client.get(origin.get_absolute_url(),
+                        data={'pid': 2, 'oid': 3})
+        self.assertHits(origin, 0)
+        with self.assertNumQueries(2):
+            hit_counter.flush()
+        self.assertHits(origin, 4, pid=('1', 3), oid=('3', 1))
+        self.assertFalse(QuerystringParameter.objects.filter(
+            identifier='kid').exists())
+
+        # existing parameter rows are updated in bulk
+        self.client.get(origin.get_absolute_url(), data={'pid': 1})
+        self.client.get(origin.get_absolute_url(), data={'pid': 2})
+        with self.assertNumQueries(2):
+            hit_counter.flush()
+        self.assertHits(origin, 6, pid=('1', 4))
+        self.assertHits(origin, 6, pid=('2', 2))
+
+    def test_memory_hits_are_flushed(self):
+        self.click_and_flush(create_origin())
+
+    @override_settings(INSIGHT_HIT_COUNTER='cache')
+    def test_cache_hits_are_flushed(self):
+        self.click_and_flush(create_origin())
+
+    @override_settings(INSIGHT_HIT_COUNTER='cache')
+    def test_locked_cache_hits_are_left(self):
+        origin = create_origin()
+        self.client.get(origin.get_absolute_url())
+        cache_key = hit_counter.make_cache_key((origin.pk, None, None))
+        # another process is taking the counter
+        hit_counter.cache.add('%s:lock' % cache_key, 1)
+        hit_counter.flush()
+        self.assertHits(origin, 0)
+        self.assertEqual(hit_counter.cache.get(cache_key), 1)
+        hit_counter.cache.delete('%s:lock' % cache_key)
+        self.client.get(origin.get_absolute_url())
+        hit_counter.flush()
+        self.assertHits(origin, 2)
+
+    @override_settings(INSIGHT_HIT_FLUSH_INTERVAL=0)
+    def test_hits_are_flushed_periodically(self):
+        origin = create_origin()
+        self.client.get(origin.get_absolute_url())
+        self.assertHits(origin, 1)
+
+    @override_settings(INSIGHT_HIT_COUNTER=None)
+    def test_hits_not_counted(self):
+        origin = create_origin()
+        self.client.get(origin.get_absolute_url())
+        hit_counter.flush()
+        self.assertHits(origin, 0)
+
+
+@override_settings(INSIGHT_COUNTER_SHARDS=4)
+class CounterShardTestCase(TestCase):
+    urls = 'insight.test.urls'
+
+    def register(self, origin, username, **params):
+        self.client.cookies.clear()
+        self.client.get(origin.get_absolute_url(), data=params)
+        create_user(username, 'password')
+        self.client.login(username=username, password='password')
+
+    def test_registrations_are_sharded(self):
+        origin = create_origin()
+        origin.querystring_parameters = "pid"
+        origin.save()
+        for i in range(5):
+            self.register(origin, 'username%d' % i, pid=1)
+
+        origin = Origin.objects.get(pk=origin.pk)
+        param = QuerystringParameter.objects.get(origin=origin)
+        self.assertEqual(origin.number_of_registrations, 0)
+        self.assertEqual(param.number_of_registrations, 0)
+        self.assertTrue(1 <= origin.counter_shards.count() <= 4)
+        self.assertEqual(origin.total_registrations, 5)
+        self.assertEqual(param.total_registrations, 5)
+        with self.assertNumQueries(1):
+            origin = with_shards(Origin.objects.all()).get(pk=origin.pk)
+            self.assertEqual(origin.total_registrations, 5)
+
+        call_command('insight_fold_counters', stdout=StringIO())
+        origin = Origin.objects.get(pk=origin.pk)
+        param = QuerystringParameter.objects.get(origin=origin)
+        self.assertEqual(origin.number_of_registrations, 5)
+        self.assertEqual(param.number_of_registrations, 5)
+        self.assertEqual(origin.total_registrations, 5)
+        self.assertEqual(param.total_registrations, 5)
+        self.assertFalse(OriginCounterShard.objects.exclude(
+            number_of_registrations=0).exists())
+
+
+@override_settings(INSIGHT_DEFERRED_TRACKING=True)
+class DeferredTrackingTestCase(TestCase):
+    urls = 'insight.test.urls'
+
+    def test_registrations_are_deferred(self):
+        origin = create_origin()
+        origin.querystring_parameters = "pid\noid"
+        origin.save()
+        users = []
+        for i in range(3):
+            self.client.cookies.clear()
+            self.client.get(origin.get_absolute_url(),
+                            data={'pid': i % 2, 'kid': 1})
+            users.append(create_user('username%d' % i, 'password'))
+            self.client.login(username='username%d' % i, password='password')
+        self.assertFalse('insight_code' in self.client.session)
+        self.assertFalse(Registration.objects.exists())
+        self.assertEqual(PendingRegistration.objects.count(), 3)
+
+        # logging in again doesn't register the user twice
+        self.client.get(origin.get_absolute_url())
+        self.client.login(username='username2', password='password')
+
+        call_command('insight_process_registrations', stdout=StringIO())
+        self.assertFalse(PendingRegistration.objects.exists())
+        self.assertEqual(Registration.objects.filter(origin=origin).count(),
+                         3)
+        self.assertEqual(
+            Origin.objects.get(pk=origin.pk).number_of_registrations, 3)
+        self.assertEqual(QuerystringParameter.objects.get(
+            origin=origin, identifier='pid', value='0'
+        ).number_of_registrations, 2)
+        self.assertEqual(QuerystringParameter.objects.get(
+            origin=origin, identifier='pid', value='1'
+        ).number_of_registrations, 1)
+        self.assertEqual(QuerystringParameter.objects.count(), 2)
+
+
+class QuerystringParameterIncrementTestCase(TestCase):
+
+    def increment(self, origin):
+        QuerystringParameter.objects.increment('number_of_registrations', {
+            (origin.pk, 'pid', '1'): 1,
+            (origin.pk, 'oid', 'x' * 60): 2,
+            (origin.pk, 'oid', 'x' * 70): 1,
+        })
+
+    def assertCounts(self, origin, pid, oid):
+        self.assertEqual(QuerystringParameter.objects.get(
+            origin=origin, identifier='pid', value='1'
+        ).number_of_registrations, pid)
+        self.assertEqual(QuerystringParameter.objects.get(
+            origin=origin, identifier='oid', value='x' * 50
+        ).number_of_registrations, oid)
+
+    def test_upsert(self):
+        origin = create_origin()
+        with self.assertNumQueries(1):
+            self.increment(origin)
+        self.assertCounts(origin, 1, 3)
+        with self.assertNumQueries(1):
+            self.increment(origin)
+        self.assertCounts(origin, 2, 6)
+
+    def test_fallback(self):
+        import insight.models
+        supports_upsert = insight.models.supports_upsert
+        insight.models.supports_upsert = lambda connection: False
+        try:
+            origin = create_origin()
+            self.increment(origin)
+            self.assertCounts(origin, 1, 3)
+            self.increment(origin)
+            self.assertCounts(origin, 2, 6)
+        finally:
+            insight.models.supports_upsert = supports_upsert
+
+    def test_upsert_increment_fallback(self):
+        import insight.sql
+        supports_upsert = insight.sql.supports_upsert
+        insight.sql.supports_upsert = lambda connection: False
+        try:
+            origin = create_origin()
+            day = datetime.date(2000, 1, 1)
+            for i in range(2):
+                upsert_increment(RegistrationArchive, ('origin', 'day'),
+                                 ('number_of_registrations',),
+                                 [(origin.pk, day, 2)])
+        finally:
+            insight.sql.supports_upsert = supports_upsert
+        self.assertEqual(RegistrationArchive.objects.get(
+            origin=origin, day=day).number_of_registrations, 4)
+
+
+@override_settings(
+    INSIGHT_STORAGE='cookie',
+    MIDDLEWARE_CLASSES=settings.MIDDLEWARE_CLASSES +
+    ('insight.middleware.TrackingCookieMiddleware',)
+)
+class CookieStorageTestCase(TestCase):
+    urls = 'insight.test.urls'
+
+    def test_registration_is_recorded(self):
+        origin = create_origin()
+        origin.querystring_parameters = "pid"
+        origin.save()
+        self.client.get(origin.get_absolute_url(),
+                        data={'pid': 123, 'kid': 1})
+        self.assertFalse(settings.SESSION_COOKIE_NAME in self.client.cookies)
+        self.assertTrue('insight' in self.client.cookies)
+
+        user = create_user('username', 'password')
+        self.client.post(reverse('django.contrib.auth.views.login'),
+                         {'username': 'username', 'password': 'password'})
+        self.assertTrue(Registration.objects.filter(user=user,
+                                                    origin=origin).exists())
+        self.assertEqual(QuerystringParameter.objects.get(
+            origin=origin, identifier='pid', value='123'
+        ).number_of_registrations, 1)
+        self.assertEqual(self.client.cookies['insight'].value, '')
+
+    def test_tampered_cookie_is_ignored(self):
+        origin = create_origin()
+        self.client.get(origin.get_absolute_url())
+        self.client.cookies['insight'] = '["%s",{}]' % origin.code
+        create_user('username', 'password')
+        self.client.post(reverse('django.contrib.auth.views.login'),
+                         {'username': 'username', 'password': 'password'})
+        self.assertFalse(Registration.objects.exists())
+
+
+@override_settings(INSIGHT_ROLLUPS=True, INSIGHT_ROLLUP_LAG=0,
+                   INSIGHT_HIT_FLUSH_INTERVAL=3600)
+class RollupTestCase(TestCase):
+    urls = 'insight.test.urls'
+
+    def setUp(self):
+        hit_counter.collect()
+
+    def test_rollups(self):
+        origin = create_origin()
+        origin.querystring_parameters = "pid"
+        origin.save()
+        for i in range(3):
+            self.client.cookies.clear()
+            self.client.get(origin.get_absolute_url(), data={'pid': 1})
+            create_user('username%d' % i, 'password')
+            self.client.login(username='username%d' % i, password='password')
+        hit_counter.flush()
+
+        call_command('insight_rollup', stdout=StringIO())
+        # rolling up again doesn't count registrations twice
+        call_command('insight_rollup', stdout=StringIO())
+        for period in ('hour', 'day'):
+            rollup = OriginRollup.objects.get(origin=origin, period=period)
+            self.assertEqual(rollup.number_of_registrations, 3)
+            self.assertEqual(rollup.number_of_hits, 3)
+            rollup = QuerystringParameterRollup.objects.get(
+                origin=origin, identifier='pid', value='1', period=period)
+            self.assertEqual(rollup.number_of_registrations, 3)
+            self.assertEqual(rollup.number_of_hits, 3)
+        self.assertEqual(
+            OriginRollup.objects.get(period='hour').start.minute, 0)
+        self.assertEqual(OriginRollup.objects.get(period='day').start.hour,
+                         0)
+
+    @override_settings(INSIGHT_ROLLUP_LAG=3600)
+    def test_registrations_are_rolled_up_after_the_lag(self):
+        origin = create_origin()
+        Registration.objects.create(user=create_user('user1', 'password'),
+                                    origin=origin)
+
+        def age_seen():
+            RollupMark.objects.filter(name=SEEN_MARK).update(
+                updated=timezone.now() - datetime.timedelta(hours=2))
+
+        self.assertEqual(rollup_registrations(), 0)
+        age_seen()
+        self.assertEqual(rollup_registrations(), 1)
+        # a deferred registration gets a higher id but an earlier time
+        earlier = timezone.now() - datetime.timedelta(days=2)
+        registration = Registration.objects.create(
+            user=create_user('user2', 'password'), origin=origin)
+        Registration.objects.filter(pk=registration.pk).update(
+            created=earlier)
+        self.assertEqual(rollup_registrations(), 0)
+        age_seen()
+        self.assertEqual(rollup_registrations(), 1)
+        self.assertEqual(OriginRollup.objects.get(
+            period='day', start__lt=earlier).number_of_registrations, 1)
+
+
+class AdminTestCase(TestCase):
+    urls = 'insight.test.urls'
+
+    def setUp(self):
+        create_user('admin', 'password')
+        User.objects.filter(username='admin').update(is_staff=True,
+                                                     is_superuser=True)
+        self.client.login(username='admin', password='password')
+        resolver.shared.clear()
+
+    def create_origins(self, n):
+        group = OriginGroup.objects.create(title='group')
+        for i in range(n):
+            origin = create_origin('origin%d' % i)
+            origin.origin_group = group
+            origin.number_of_registrations = i
+            origin.save()
+            OriginRollup.objects.create(
+                origin=origin, period='day',
+                start=timezone.now().replace(hour=0, minute=0, second=0,
+                                             microsecond=0),
+                number_of_registrations=i)
+
+    def test_stats(self):
+        self.create_origins(2)
+        create_origin('ungrouped')
+        url = reverse('admin:insight_origin_stats')
+        response = self.client.get(url, data={'days': 7})
+        self.assertEqual(response.status_code, 200)
+        stats = response.context['stats']
+        self.assertEqual(stats['total'], 1)
+        self.assertEqual(stats['origins'][0]['title'], 'origin1')
+        self.assertEqual(stats['origins'][0]['share'], 100.0)
+        self.assertEqual(stats['origins'][0]['window'], 1)
+        self.assertEqual(stats['groups'][0]['registrations'], 1)
+        self.assertEqual(stats['groups'][0]['origins'], 2)
+
+        self.create_origins(20)
+        resolver.shared.clear()
+        # the number of queries doesn't depend on the number of origins
+        with self.assertNumQueries(6):
+            self.client.get(url, data={'days': 7})
+        # and the stats are cached
+        with self.assertNumQueries(2):
+            self.client.get(url, data={'days': 7})
+
+    def test_changelists(self):
+        self.create_origins(2)
+        for origin in Origin.objects.all():
+            QuerystringParameter.objects.create(origin=origin,
+                                                identifier='pid', value='1')
+        origin_url = reverse('admin:insight_origin_changelist')
+        param_url = reverse('admin:insight_querystringparameter_changelist')
+        for url, queries in ((origin_url, 6), (param_url, 5)):
+            Site.objects.clear_cache()
+            with self.assertNumQueries(queries):
+                response = self.client.get(url)
+            self.assertEqual(len(response.context['cl'].result_list), 2)
+
+        self.create_origins(20)
+        for origin in Origin.objects.filter(querystringparameter=None):
+            QuerystringParameter.objects.create(origin=origin,
+                                                identifier='pid', value='1')
+        # the number of queries doesn't depend on the number of rows
+        for url, queries in ((origin_url, 6), (param_url, 5)):
+            Site.objects.clear_cache()
+            with self.assertNumQueries(queries):
+                response = self.client.get(url)
+            self.assertEqual(len(response.context['cl'].result_list), 22)
+
+        code = Origin.objects.all()[0].code
+        response = self.client.get(origin_url, data={'q': code})
+        self.assertEqual(len(response.context['cl'].result_list), 1)
+        # titles are searched by prefix, case-insensitively; on PostgreSQL
+        # that compares UPPER(title), which has an index of its own
+        response = self.client.get(origin_url, data={'q': 'Origin1'})
+        # origin1 from both batches and origin10 to origin19
+        self.assertEqual(len(response.context['cl'].result_list), 12)
+        response = self.client.get(origin_url, data={'q': 'rigin1'})
+        self.assertEqual(len(response.context['cl'].result_list), 0)
+
+    def test_changelist_ordered_by_total(self):
+        sharded = create_origin('sharded')
+        unsharded = create_origin('unsharded')
+        Origin.objects.filter(pk=unsharded.pk).update(
+            number_of_registrations=3)
+        Origin.objects.filter(pk=sharded.pk).update(
+            number_of_registrations=1)
+        OriginCounterShard.objects.create(origin=sharded, shard=0,
+                                          number_of_registrations=5)
+        # the sixth column, after the action checkbox
+        response = self.client.get(reverse('admin:insight_origin_changelist'),
+                                   data={'o': '-5'})
+        self.assertEqual([origin.total_registrations for origin
+                          in response.context['cl'].result_list], [6, 3])
+
+    def test_funnel(self):
+        origin = create_origin()
+        Origin.objects.filter(pk=origin.pk).update(number_of_hits=20,
+                                                   number_of_registrations=5)
+        for i in range(12):
+            QuerystringParameter.objects.create(
+                origin=origin, identifier='pid' if i % 2 else 'oid',
+                value=str(i), number_of_registrations=i,
+                number_of_hits=i * 4)
+        url = reverse('admin:insight_origin_funnel', args=(origin.pk,))
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        funnel = response.context['funnel']
+        self.assertEqual(funnel['origin']['conversion'], 25.0)
+        self.assertEqual([row['value'] for row in funnel['parameters']],
+                         [str(i) for i in range(11, 1, -1)])
+        self.assertEqual(funnel['parameters'][0]['conversion'], 25.0)
+
+        response = self.client.get(url, data={
+            'format': 'json', 'identifier': 'oid', 'limit': 2})
+        funnel = json.loads(response.content)
+        self.assertEqual([row['value'] for row in funnel['parameters']],
+                         ['10', '8'])
+        response = self.client.get(url, data={'limit': -1})
+        self.assertEqual(len(response.context['funnel']['parameters']), 1)
+        self.assertEqual(self.client.get(
+            reverse('admin:insight_origin_funnel', args=(0,))
+        ).status_code, 404)
+
+    def test_export_action(self):
+        origin = create_origin()
+        create_origin()
+        user = User.objects.get(username='admin')
+        Registration.objects.create(user=user, origin=origin)
+        response = self.client.post(
+            reverse('admin:insight_origin_changelist'),
+            {'action': 'export_registrations', 'index': 0,
+             '_selected_action': origin.pk},
+            follow=True
+        )
+        lines = ''.join(response.streaming_content).splitlines()
+        self.assertEqual(lines[0],
+                         'id,user_id,username,origin_id,origin_code,created')
+        self.assertEqual(lines[1].split(',')[1:5],
+                         [str(user.pk), 'admin', str(origin.pk), origin.code])
+        self.assertEqual(len(lines), 2)
+
+    def test_export_action_across_pages(self):
+        origin = create_origin()
+        other = create_origin()
+        user = User.objects.get(username='admin')
+        Registration.objects.create(user=user, origin=origin)
+        Registration.objects.create(user=create_user('other', 'password'),
+                                    origin=other)
+        response = self.client.post(
+            '%s?q=%s' % (reverse('admin:insight_origin_changelist'),
+                         origin.code),
+            {'action': 'export_registrations', 'index': 0,
+             '_selected_action': origin.pk, 'select_across': 1})
+        # the changelist filters are passed on instead of the origins
+        self.assertFalse('origin=' in response['Location'])
+        response = self.client.get(response['Location'])
+        lines = ''.join(response.streaming_content).splitlines()
+        self.assertEqual([line.split(',')[4] for line in lines[1:]],
+                         [origin.code])
+
+
+class ExportTestCase(TestCase):
+
+    def test_export_command(self):
+        origin1 = create_origin()
+        origin2 = create_origin()
+        for i in range(5):
+            Registration.objects.create(
+                user=create_user('username%d' % i, 'password'),
+                origin=origin1 if i % 2 else origin2
+            )
+        QuerystringParameter.objects.create(origin=origin1, identifier='pid',
+                                            value=u'\xe9',
+                                            number_of_registrations=2)
+
+        out = StringIO()
+        call_command('insight_export', 'registrations', format='jsonl',
+                     codes=[origin1.code], batch_size=1, stdout=out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([row['username'] for row in rows],
+                         ['username1', 'username3'])
+        self.assertEqual(rows[0]['origin_code'], origin1.code)
+
+        out = StringIO()
+        call_command('insight_export', 'registrations', since='2000-01-01',
+                     until='2000-01-02', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 1)
+
+        out = StringIO()
+        call_command('insight_export', 'parameters', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].endswith(',pid,\xc3\xa9,2,0'))
+
+
+class BulkOriginTestCase(TestCase):
+
+    def test_generate_codes(self):
+        create_origin()
+        with self.assertNumQueries(1):
+            codes = generate_codes(50)
+        self.assertEqual(len(set(codes)), 50)
+
+    def test_generated_codes_skip_excluded(self):
+        # one hex digit leaves a single code that isn't excluded
+        self.assertEqual(
+            generate_codes(1, length=1, exclude='0123456789abcde'), ['f'])
+
+    @override_settings(INSIGHT_CODE_LENGTH=12)
+    def test_create_origins_command(self):
+        OriginGroup.objects.create(title='affiliates')
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w') as f:
+            f.write("title,code,origin_group,querystring_parameters\n"
+                    "one,,affiliates,pid oid\n"
+                    "two,mycode,new group,\n")
+        try:
+            out = StringIO()
+            call_command('insight_create_origins', path, stdout=out)
+        finally:
+            os.remove(path)
+        one = Origin.objects.get(title='one')
+        two = Origin.objects.get(title='two')
+        self.assertEqual(len(one.code), 12)
+        self.assertEqual(one.parameter_list, ['pid', 'oid'])
+        self.assertEqual(one.origin_group.title, 'affiliates')
+        self.assertEqual(two.code, 'mycode')
+        self.assertEqual(two.origin_group.title, 'new group')
+        self.assertEqual(OriginGroup.objects.count(), 2)
+        self.assertTrue(one.code in out.getvalue())
+
+
+class InstrumentationTestCase(TestCase):
+    urls = 'insight.test.urls'
+
+    def setUp(self):
+        aggregator.reset()
+
+    def test_disabled(self):
+        self.assertTrue(measure('origin_lookup') is NOOP)
+
+    @override_settings(INSIGHT_INSTRUMENTATION=True,
+                       INSIGHT_INSTRUMENTATION_PUBLISH_INTERVAL=0)
+    def test_operations_are_measured(self):
+        measured = []
+
+        def handler(sender, **kwargs):
+            measured.append((kwargs['operation'], kwargs['queries']))
+
+        operation_measured.connect(handler)
+        try:
+            origin = create_origin()
+            origin.querystring_parameters = "pid"
+            origin.save()
+            self.client.get(origin.get_absolute_url(), data={'pid': 1})
+            create_user('username', 'password')
+            self.client.login(username='username', password='password')
+        finally:
+            operation_measured.disconnect(handler)
+        self.assertEqual(measured, [
+            ('origin_lookup', 1),
+            ('storage_save', 0),
+            # the origin cached by the click is reused
+            ('origin_lookup', 0),
+            ('registration_insert', 2),
+            ('counter_update', 1),
+            ('parameter_upsert', 1),
+        ])
+        from django.db import connection
+        self.assertEqual(connection.queries, [])
+
+        out = StringIO()
+        call_command('insight_instrumentation', stdout=out)
+        self.assertTrue('registration_insert' in out.getvalue())
+        self.assertEqual(len(aggregator.collect()['origin_lookup']), 2)
+
+    def test_processes_are_indexed(self):
+        cache = aggregator.cache
+        for process in ('web1:100', 'web2:100'):
+            cache.set(aggregator.process_key(process),
+                      {'origin_lookup': [(0.001, 1)]})
+            aggregator.register(process, 60)
+        # processes whose samples have expired are dropped
+        cache.delete(aggregator.process_key('web1:100'))
+        cache.set(aggregator.process_key('web3:100'), {})
+        aggregator.register('web3:100', 60)
+        self.assertEqual(cache.get(aggregator.index_key),
+                         ['web2:100', 'web3:100'])
+        # the index isn't written while another process holds its lock
+        cache.add(aggregator.lock_key, 1)
+        aggregator.register('web4:100', 60)
+        cache.delete(aggregator.lock_key)
+        self.assertEqual(len(aggregator.collect()['origin_lookup']), 1)
+        self.assertEqual(cache.get(aggregator.index_key),
+                         ['web2:100', 'web3:100'])
+
+
+class PausedEventRecorder(EventRecorder):
+
+    def start(self):
+        pass
+
+
+class EventLogTestCase(TestCase):
+    urls = 'insight.test.urls'
+
+    @override_settings(INSIGHT_EVENT_LOG='database', INSIGHT_EVENT_ASYNC=False)
+    def test_database_log(self):
+        origin = create_origin()
+        origin.querystring_parameters = "pid"
+        origin.save()
+        self.client.get(origin.get_absolute_url(), data={'pid': 1, 'x': 2},
+                        HTTP_REFERER='http://example.com/',
+                        HTTP_USER_AGENT='Mozilla/5.0')
+        hit = Hit.objects.get()
+        self.assertEqual(hit.origin, origin)
+        self.assertEqual(hit.code, origin.code)
+        self.assertEqual(json.loads(hit.params), {'pid': '1'})
+        self.assertEqual(hit.referrer, 'http://example.com/')
+        self.assertEqual(len(hit.user_agent_hash), 40)
+
+    def test_file_log_is_rotated(self):
+        directory = tempfile.mkdtemp()
+        # each process writes its own file
+        path = os.path.join(directory, 'hits-%(pid)s.log')
+        origin = create_origin()
+        try:
+            with self.settings(INSIGHT_EVENT_LOG='file',
+                               INSIGHT_EVENT_LOG_PATH=path,
+                               INSIGHT_EVENT_LOG_MAX_BYTES=1,
+                               INSIGHT_EVENT_LOG_BACKUPS=2,
+                               INSIGHT_EVENT_BATCH_SIZE=1):
+                for i in range(3):
+                    self.client.get(origin.get_absolute_url())
+                recorder.flush()
+            name = 'hits-%d.log' % os.getpid()
+            self.assertEqual(sorted(os.listdir(directory)),
+                             [name + '.1', name + '.2'])
+            with open(os.path.join(directory, name + '.1')) as f:
+                event = json.loads(f.read())
+            self.assertEqual(event['code'], origin.code)
+            self.assertEqual(event['origin'], origin.pk)
+        finally:
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+            os.rmdir(directory)
+
+    @override_settings(INSIGHT_EVENT_LOG='database',
+                       INSIGHT_EVENT_QUEUE_SIZE=2)
+    def test_full_queue_drops_events(self):
+        origin = create_origin()
+        paused = PausedEventRecorder()
+        request = RequestFactory().get(origin.get_absolute_url())
+        for i in range(3):
+            paused.record(request, origin.code, origin.pk, {})
+        self.assertEqual(paused.dropped, 1)
+        self.assertEqual(Hit.objects.count(), 0)
+        paused.flush()
+        self.assertEqual(Hit.objects.count(), 2)
+
+
+@override_settings(INSIGHT_DEDUPE_WINDOW=60, INSIGHT_HIT_FLUSH_INTERVAL=3600)
+class DedupeTestCase(TestCase):
+    urls = 'insight.test.urls'
+
+    def setUp(self):
+        hit_counter.collect()
+        deduplicator.clear()
+        deduplicator.shared.clear()
+
+    def click(self, origin, client=None, **params):
+        repeats = []
+
+        def handler(sender, **kwargs):
+            repeats.append(kwargs['repeat'])
+
+        origin_hit.connect(handler)
+        try:
+            (client or self.client).get(origin.get_absolute_url(),
+                                        data=params)
+        finally:
+            origin_hit.disconnect(handler)
+        return repeats[0]
+
+    def assert_repeats_skipped(self):
+        origin = create_origin()
+        origin.querystring_parameters = "pid"
+        origin.save()
+        other = create_origin('other')
+        self.assertFalse(self.click(origin, pid=1))
+        self.assertTrue(self.click(origin, pid=2))
+        # repeats with other parameters are still stored
+        self.assertEqual(self.client.session['insight_params'], {'pid': '2'})
+        # clicking back to an origin isn't a repeat
+        self.assertFalse(self.click(other))
+        self.assertFalse(self.click(origin, pid=3))
+        self.assertEqual(self.client.session['insight_code'], origin.code)
+        self.assertEqual(self.client.session['insight_params'], {'pid': '3'})
+        # nor is a click by another visitor with the same address and agent
+        self.assertFalse(self.click(origin, client=self.client_class()))
+        hit_counter.flush()
+        self.assertEqual(Origin.objects.get(pk=origin.pk).number_of_hits, 3)
+
+    def test_repeats_are_skipped(self):
+        self.assert_repeats_skipped()
+
+    @override_settings(INSIGHT_DEDUPE_BACKEND='cache')
+    def test_repeats_are_skipped_with_cache(self):
+        self.assert_repeats_skipped()
+
+    def test_repeats_skip_the_session_write(self):
+        origin = create_origin()
+        response = self.client.get(origin.get_absolute_url())
+        self.assertIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        response = self.client.get(origin.get_absolute_url())
+        # the session wasn't saved, or its cookie would have been set again
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertEqual(self.client.session['insight_code'], origin.code)
+
+    @override_settings(INSIGHT_COUNT_REPEAT_HITS=True)
+    def test_repeat_hits_counted(self):
+        origin = create_origin()
+        for i in range(3):
+            self.client.get(origin.get_absolute_url())
+        hit_counter.flush()
+        self.assertEqual(Origin.objects.get(pk=origin.pk).number_of_hits, 3)
+
+
+class ReconcileTestCase(TestCase):
+    urls = 'insight.test.urls'
+
+    def setUp(self):
+        hit_counter.collect()
+        resolver.shared.clear()
+
+    def register(self, origin, n, **params):
+        for i in range(n):
+            self.client.cookies.clear()
+            self.client.get(origin.get_absolute_url(), data=params)
+            username = 'user%d' % User.objects.count()
+            create_user(username, 'password')
+            self.client.login(username=username, password='password')
+
+    def reconcile(self, **options):
+        out = StringIO()
+        call_command('insight_reconcile_counters', stdout=out, batch_size=1,
+                     **options)
+        return out.getvalue()
+
+    def test_registration_counters(self):
+        origin = create_origin()
+        other = create_origin('other')
+        self.register(origin, 3)
+        self.register(other, 1)
+        Origin.objects.filter(pk=origin.pk).update(number_of_registrations=1)
+        OriginCounterShard.objects.create(origin=other, shard=0,
+                                          number_of_registrations=2)
+
+        out = self.reconcile(dry_run=True)
+        self.assertTrue('Would correct 2 counters' in out)
+        self.assertEqual(
+            Origin.objects.get(pk=origin.pk).number_of_registrations, 1)
+
+        out = self.reconcile()
+        self.assertTrue('number_of_registrations: 1 -> 3' in out)
+        self.assertTrue('number_of_registrations: 3 -> 1' in out)
+        self.assertEqual(
+            Origin.objects.get(pk=origin.pk).number_of_registrations, 3)
+        self.assertEqual(
+            with_shards(Origin.objects.filter(pk=other.pk))
+            .get().total_registrations, 1)
+        self.assertTrue('Corrected 0 counters' in self.reconcile())
+
+    @override_settings(INSIGHT_ROLLUPS=True, INSIGHT_EVENT_LOG='database',
+                       INSIGHT_EVENT_ASYNC=False)
+    def test_hit_and_parameter_counters(self):
+        origin = create_origin()
+        origin.querystring_parameters = "pid"
+        origin.save()
+        self.register(origin, 2, pid=1)
+        hit_counter.flush()
+        Origin.objects.update(number_of_hits=0)
+        QuerystringParameter.objects.update(number_of_registrations=5,
+                                            number_of_hits=7)
+
+        out = self.reconcile(hits=True, parameters=True)
+        self.assertTrue('Corrected 3 counters' in out)
+        origin = Origin.objects.get(pk=origin.pk)
+        self.assertEqual(origin.number_of_hits, 2)
+        param = QuerystringParameter.objects.get(origin=origin)
+        self.assertEqual(param.number_of_registrations, 2)
+        self.assertEqual(param.number_of_hits, 2)
+
+
+@override_settings(INSIGHT_ROLLUP_LAG=0)
+class RetentionTestCase(TestCase):
+    urls = 'insight.test.urls'
+
+    def test_old_registrations_are_archived(self):
+        origin = create_origin()
+        for i in range(3):
+            self.client.cookies.clear()
+            self.client.get(origin.get_absolute_url())
+            create_user('username%d' % i, 'password')
+            self.client.login(username='username%d' % i, password='password')
+        old = timezone.now() - datetime.timedelta(days=40)
+        Registration.objects.exclude(user__username='username2') \
+            .update(created=old)
+
+        out = StringIO()
+        call_command('insight_archive_registrations', days=30, stdout=out)
+        # registrations are only archived once they've been rolled up
+        self.assertTrue('Archived 0 registrations' in out.getvalue())
+        call_command('insight_rollup', stdout=StringIO())
+        out = StringIO()
+        call_command('insight_archive_registrations', days=30, dry_run=True,
+                     stdout=out)
+        self.assertTrue('Would archive 2 registrations' in out.getvalue())
+        call_command('insight_archive_registrations', days=30, batch_size=1,
+                     stdout=StringIO())
+
+        self.assertEqual(list(Registration.objects.values_list(
+            'user__username', flat=True)), ['username2'])
+        archive = RegistrationArchive.objects.get(origin=origin)
+        self.assertEqual(archive.day, old.date())
+        self.assertEqual(archive.number_of_registrations, 2)
+        # archived users aren't registered again
+        self.client.cookies.clear()
+        self.client.get(origin.get_absolute_url())
+        self.client.login(username='username0', password='password')
+        self.assertEqual(Registration.objects.count(), 1)
+        self.assertEqual(Origin.objects.get(pk=origin.pk)
+                         .number_of_registrations, 3)
+        out = StringIO()
+        call_command('insight_reconcile_counters', stdout=out)
+        self.assertTrue('Corrected 0 counters' in out.getvalue())
+
+
+@override_settings(INSIGHT_ATTRIBUTION=True)
+class AttributionTestCase(TestCase):
+    urls = 'insight.test.urls'
+
+    def assertCredits(self, origin, first_touch, last_touch, linear):
+        attribution = OriginAttribution.objects.get(origin=origin)
+        self.assertEqual((attribution.first_touch, attribution.last_touch),
+                         (first_touch, last_touch))
+        self.assertAlmostEqual(attribution.linear, linear)
+
+    def click_and_register(self):
+        origins = [create_origin('origin%d' % i) for i in range(3)]
+        for i in (0, 1, 0, 2):
+            self.client.get(origins[i].get_absolute_url())
+        create_user('username', 'password')
+        # logs in through the view, which sees the cookies
+        self.client.post(reverse('django.contrib.auth.views.login'),
+                         {'username': 'username', 'password': 'password'})
+        self.assertEqual(Registration.objects.get().origin, origins[2])
+        self.assertCredits(origins[0], 1, 0, 1.0 / 3)
+        self.assertCredits(origins[1], 0, 0, 1.0 / 3)
+        self.assertCredits(origins[2], 0, 1, 1.0 / 3)
+
+    def test_session_touches(self):
+        self.click_and_register()
+        self.assertFalse('insight_touches' in self.client.session)
+
+    @override_settings(INSIGHT_STORAGE='cookie')
+    def test_cookie_touches(self):
+        self.click_and_register()
+
+    @override_settings(INSIGHT_DEFERRED_TRACKING=True)
+    def test_deferred_touches(self):
+        origin = create_origin()
+        self.client.get(origin.get_absolute_url())
+        create_user('username', 'password')
+        self.client.login(username='username', password='password')
+        call_command('insight_process_registrations', stdout=StringIO())
+        self.assertCredits(origin, 1, 1, 1.0)
+
+    @override_settings(INSIGHT_MAX_TOUCHES=3)
+    def test_touches_are_capped(self):
+        touches = []
+        for i, code in enumerate('abcbda'):
+            touches = add_touch(touches, code, now=i)
+        # the first touch is kept, later touches replace earlier ones
+        self.assertEqual(touches, [['a', 0], ['d', 4], ['a', 5]])
+        self.assertEqual(add_touch([['a', 0]], 'a', now=1), [['a', 0]])
+
+
+@override_settings(INSIGHT_REPORTING_DATABASE='replica')
+class ReportingDatabaseTestCase(TestCase):
+    urls = 'insight.test.urls'
+    multi_db = True
+
+    def setUp(self):
+        create_user('admin', 'password')
+        User.objects.filter(username='admin').update(is_staff=True,
+                                                     is_superuser=True)
+        self.client.login(username='admin', password='password')
+        resolver.shared.clear()
+        # the primary and the replica hold different origins, so it shows
+        # which one is read
+        self.origin = create_origin('primary')
+        self.replica_origin = Origin(title='replica', code='replica')
+        self.replica_origin.save(using='replica')
+
+    def test_reports_read_from_replica(self):
+        self.assertEqual([o['title'] for o in compute_stats(7)['origins']],
+                         ['replica'])
+        lines = list(export_lines('parameters'))
+        self.assertEqual(len(lines), 1)
+        response = self.client.get(
+            reverse('admin:insight_origin_changelist'))
+        self.assertEqual(
+            [o.title for o in response.context['cl'].result_list],
+            ['replica'])
+        # other reads, e.g. those of the rollups before incrementing them,
+        # stay on the primary
+        self.assertEqual(OriginRollup.objects.db, 'default')
+
+    def test_tracking_uses_primary(self):
+        self.client.logout()
+        self.client.get(self.origin.get_absolute_url())
+        user = create_user('username', 'password')
+        self.client.login(username='username', password='password')
+        self.assertEqual(Registration.objects.get(user=user).origin,
+                         self.origin)
+        self.assertFalse(Registration.objects.using('replica').exists())
+
+
+@override_settings(INSIGHT_HEAVY_HITTER_PARAMETERS=('clickid',),
+                   INSIGHT_HEAVY_HITTER_CAPACITY=3,
+                   INSIGHT_HIT_FLUSH_INTERVAL=3600)
+class HeavyHitterTestCase(TestCase):
+    urls = 'insight.test.urls'
+
+    def setUp(self):
+        hit_counter.collect()
+
+    def test_space_saving(self):
+        sketch = SpaceSaving(2)
+        for value in 'aabac':
+            sketch.add(value)
+        self.assertEqual(sketch.top(), [('a', 3, 0), ('c', 2, 1)])
+        self.assertEqual(sketch.guaranteed('c'), 1)
+        self.assertEqual(sketch.guaranteed('b'), 0)
+
+    def test_long_tail_is_bucketed(self):
+        origin = create_origin()
+        origin.querystring_parameters = "clickid\npid"
+        origin.save()
+        clicks = ['a'] * 3 + ['b'] * 2 + ['u%d' % i for i in range(10)]
+        for clickid in clicks:
+            self.client.get(origin.get_absolute_url(),
+                            data={'clickid': clickid, 'pid': 1})
+        hit_counter.flush()
+        self.assertEqual(dict(QuerystringParameter.objects.filter(
+            identifier='clickid').values_list('value', 'number_of_hits')),
+            {'a': 3, 'b': 2, OTHER: 10})
+        # other parameters are counted as before
+        self.assertEqual(QuerystringParameter.objects.get(
+            identifier='pid').number_of_hits, 15)
+
+        # promoted values keep their row once the sketch has evicted them
+        self.client.get(origin.get_absolute_url(), data={'clickid': 'a'})
+        hit_counter.flush()
+        self.assertEqual(QuerystringParameter.objects.get(
+            identifier='clickid', value='a').number_of_hits, 4)
+
+        # registrations are bucketed without updating the sketch
+        counters = ParameterSketch.objects.get().counters
+        for username, clickid in (('user1', 'a'), ('user2', 'new')):
+            self.client.get(origin.get_absolute_url(),
+                            data={'clickid': clickid})
+            create_user(username, 'password')
+            self.client.login(username=username, password='password')
+            self.client.logout()
+        self.assertEqual(dict(QuerystringParameter.objects.filter(
+            identifier='clickid').values_list('value',
+                                              'number_of_registrations')),
+            {'a': 1, 'b': 0, OTHER: 1})
+        self.assertEqual(ParameterSketch.objects.get().counters, counters)
+
+
+@override_settings(INSIGHT_UNIQUE_VISITORS=True)
+class UniqueVisitorsTestCase(TestCase):
+    urls = 'insight.test.urls'
+
+    def setUp(self):
+        visitor_counter.collect()
+
+    def test_sketch(self):
+        a, b = HyperLogLog(), HyperLogLog()
+        for i in range(3000):
+            a.add('visitor%d' % i)
+        for i in range(2000, 5000):
+            b.add('visitor%d' % i)
+        self.assertAlmostEqual(a.count(), 3000, delta=150)
+        a.merge(b)
+        self.assertAlmostEqual(a.count(), 5000, delta=250)
+        self.assertEqual(HyperLogLog.loads(a.dumps()).registers, a.registers)
+
+    def test_visitors_are_counted(self):
+        group = OriginGroup.objects.create(title='group')
+        origin = create_origin()
+        other = create_origin('other')
+        for o in (origin, other):
+            o.origin_group = group
+            o.save()
+        for url in (origin.get_absolute_url(), origin.get_absolute_url(),
+                    other.get_absolute_url()):
+            self.client.get(url)
+        self.client_class().get(origin.get_absolute_url())
+        visitor_counter.flush()
+        # a sketch of the day before, seen by a visitor of today
+        yesterday = timezone.now().date() - datetime.timedelta(days=1)
+        sketch = HyperLogLog()
+        sketch.add(self.client.cookies['insight_visitor'].value)
+        sketch.add('earlier')
+        VisitorSketch.objects.create(origin=other, day=yesterday,
+                                     registers=sketch.dumps())
+        GroupVisitorSketch.objects.create(origin_group=group, day=yesterday,
+                                          registers=sketch.dumps())
+
+        self.assertEqual(unique_visitors(origins=[origin.pk]), 2)
+        self.assertEqual(unique_visitors(origins=[other.pk]), 2)
+        self.assertEqual(unique_visitors(group=group), 3)
+        # the group's own sketch is read rather than those of its origins
+        self.assertEqual(
+            GroupVisitorSketch.objects.get(day=timezone.now().date())
+            .origin_group, group)
+        with self.assertNumQueries(1):
+            unique_visitors(group=group)
+        self.assertEqual(unique_visitors(group=group, until=yesterday), 0)
+        self.assertEqual(unique_visitors(origins=[other.pk],
+                                         since=timezone.now().date()), 1)
+
+        out = StringIO()
+        call_command('insight_unique_visitors', group=group.pk, stdout=out)
+        self.assertEqual(out.getvalue(), "About 3 unique visitors\n")
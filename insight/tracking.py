@@ -0,0 +1,92 @@
+"""
+Deferred registration tracking.
+
+With `INSIGHT_DEFERRED_TRACKING` on, logins only capture a
+`PendingRegistration`. These are tracked in batches by `process_pending`,
+run by the `insight_process_registrations` command, using one insert for
+the registrations and grouped updates for the counters.
+"""
+import json
+from collections import Counter
+
+from django.db import transaction
+
+from insight.attribution import record_attribution
+from insight.heavyhitters import bucket_counts, bucket_values
+from insight.models import (ArchivedUser, Origin, PendingRegistration,
+                            QuerystringParameter, Registration,
+                            rollups_enabled)
+from insight.rollups import rollup_parameters
+from insight.sql import bulk_increment
+
+
+@transaction.commit_on_success
+def process_batch(batch_size=500):
+    """
+    Tracks up to `batch_size` of the oldest pending registrations and returns
+    how many were processed.
+    """
+    pending = list(PendingRegistration.objects.select_for_update()
+                   .order_by('pk')[:batch_size])
+    if not pending:
+        return 0
+
+    origins = dict(
+        (origin.code, origin) for origin in Origin.objects.filter(
+            code__in=set(p.code for p in pending),
+            track_registrations=True
+        ).only('code', 'querystring_parameters')
+    )
+    users = set(p.user_id for p in pending)
+    registered = set(Registration.objects.filter(
+        user__in=users).values_list('user', flat=True))
+    registered.update(ArchivedUser.objects.filter(
+        user__in=users).values_list('user', flat=True))
+
+    registrations = []
+    touch_lists = []
+    origin_counts = Counter()
+    param_counts = Counter()
+    param_rollups = Counter()
+    for p in pending:
+        origin = origins.get(p.code)
+        # users are only ever registered to one origin
+        if origin is None or p.user_id in registered:
+            continue
+        registered.add(p.user_id)
+        registrations.append(Registration(user_id=p.user_id, origin=origin,
+                                          created=p.created))
+        origin_counts[origin.pk] += 1
+        if p.touches:
+            touch_lists.append(json.loads(p.touches))
+        params = json.loads(p.params) if p.params else {}
+        for param, value in params.items():
+            if param in origin.parameter_set:
+                param_counts[(origin.pk, param, value)] += 1
+                param_rollups[(origin.pk, param, value, p.created)] += 1
+
+    buckets = bucket_values(param_counts)
+    param_counts = bucket_counts(param_counts, buckets)
+    param_rollups = bucket_counts(param_rollups, buckets)
+    Registration.objects.bulk_create(registrations)
+    bulk_increment(Origin, 'number_of_registrations', origin_counts)
+    QuerystringParameter.objects.increment('number_of_registrations',
+                                           param_counts)
+    if rollups_enabled():
+        rollup_parameters('number_of_registrations', param_rollups)
+    record_attribution(touch_lists)
+    PendingRegistration.objects.filter(pk__in=[p.pk for p in pending]) \
+        .delete()
+    return len(pending)
+
+
+def process_pending(batch_size=500):
+    """
+    Tracks all pending registrations and returns how many were processed.
+    """
+    total = 0
+    while True:
+        processed = process_batch(batch_size)
+        if not processed:
+            return total
+        total += processed
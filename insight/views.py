@@ -1,20 +1,51 @@
+from django.conf import settings
 from django.http import HttpResponseRedirect
 
+from insight.cache import resolve_origin
+from insight.dedupe import deduplicator
+from insight.events import recorder
+from insight.hits import hit_counter
+from insight.instrumentation import measure
 from insight.models import Origin
 from insight.signals import origin_hit
+from insight.storage import filter_params, get_storage
+from insight.visitors import (unique_visitors_enabled, visitor_counter,
+                              visitor_id)
 
 
 def set_origin_code(request, code):
-    try:
-        origin = Origin.objects.get(code=code)
-        if origin.track_registrations:
-            request.session['insight_code'] = code
-            request.session['insight_params'] = request.GET
+    with measure('origin_lookup'):
+        data = resolve_origin(code)
+    if data is None:
+        return HttpResponseRedirect("/")
 
-        origin_hit.send(sender=Origin, instance=origin, request=request)
+    params = filter_params(request.GET, data['parameter_list'])
+    response = HttpResponseRedirect(data['redirect_to'] or "/")
+    visitor = None
+    if deduplicator.window or unique_visitors_enabled():
+        visitor = visitor_id(request, response)
+    repeat = deduplicator.is_repeat(visitor, code)
+    if data['track_registrations']:
+        storage = get_storage()
+        # a repeat that would store what's stored already skips the write
+        if not repeat or storage.load(request) != (code, params):
+            with measure('storage_save'):
+                storage.save(request, response, code, params)
 
-        if origin.redirect_to:
-            return HttpResponseRedirect(origin.redirect_to)
-    except Origin.DoesNotExist:
-        pass
-    return HttpResponseRedirect("/")
+    if not repeat or getattr(settings, 'INSIGHT_COUNT_REPEAT_HITS', False):
+        hit_counter.record(data['pk'], params)
+        recorder.record(request, code, data['pk'], params)
+    if unique_visitors_enabled():
+        visitor_counter.record(data['pk'], visitor)
+
+    # the origin is only loaded for apps listening to the signal, so clicks
+    # from the cache don't reach the database otherwise
+    if origin_hit.has_listeners(Origin):
+        try:
+            origin = Origin.objects.get(pk=data['pk'])
+        except Origin.DoesNotExist:
+            # deleted since it was cached
+            return response
+        origin_hit.send(sender=Origin, instance=origin, request=request,
+                        repeat=repeat)
+    return response
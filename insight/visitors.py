@@ -0,0 +1,178 @@
+"""
+Approximate unique visitors per origin.
+
+With `INSIGHT_UNIQUE_VISITORS` on, the click view identifies a visitor by
+a random id it keeps in the `INSIGHT_VISITOR_COOKIE_NAME` cookie, which
+unlike the session key survives logging in. The id is added to a
+HyperLogLog sketch of the origin for the day, stored in `VisitorSketch`, and
+to one of the origin's group for the day, stored in `GroupVisitorSketch`.
+A visitor counts towards the group the origin was in when they clicked.
+
+Like hits, the register updates are buffered in each process and merged
+into the stored sketches at most every `INSIGHT_HIT_FLUSH_INTERVAL` seconds.
+A buffered update is only the register and rank an id falls in, so the
+buffer never holds more than a sketch per origin and day. Updates that can't
+be written are logged and dropped, as hits are, and buffers are flushed when
+a process exits.
+
+Sketches merge without double counting, so `unique_visitors` answers the
+unique visitors of any set of origins or a range of days by merging the
+daily sketches in memory. The unique visitors of a group only merge its own
+daily sketches, however many origins it has.
+"""
+import atexit
+import logging
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from insight.hyperloglog import HyperLogLog, position
+from insight.instrumentation import measure
+from insight.models import GroupVisitorSketch, Origin, VisitorSketch
+from insight.routers import reporting
+
+
+logger = logging.getLogger('insight.visitors')
+
+# changing the precision would make the stored sketches unmergeable
+PRECISION = 12
+
+
+def unique_visitors_enabled():
+    return getattr(settings, 'INSIGHT_UNIQUE_VISITORS', False)
+
+
+def visitor_id(request, response):
+    """
+    Returns the id of the visitor making `request`, setting a new one on
+    `response` if they don't have one yet.
+    """
+    name = getattr(settings, 'INSIGHT_VISITOR_COOKIE_NAME', 'insight_visitor')
+    visitor = request.COOKIES.get(name)
+    if not visitor:
+        visitor = uuid.uuid4().hex
+        response.set_cookie(
+            name, visitor, httponly=True,
+            max_age=getattr(settings, 'INSIGHT_VISITOR_COOKIE_AGE',
+                            60 * 60 * 24 * 365))
+    return visitor
+
+
+class VisitorCounter(object):
+
+    def __init__(self):
+        # (origin pk, day): {register: rank}
+        self._updates = defaultdict(dict)
+        self._lock = threading.Lock()
+        self._last_flush = time.time()
+
+    def record(self, origin_pk, visitor):
+        index, rank = position(visitor, PRECISION)
+        key = (origin_pk, timezone.now().date())
+        with self._lock:
+            registers = self._updates[key]
+            if rank > registers.get(index, 0):
+                registers[index] = rank
+
+        interval = getattr(settings, 'INSIGHT_HIT_FLUSH_INTERVAL', 10)
+        if time.time() - self._last_flush >= interval:
+            self.flush()
+
+    def collect(self):
+        """
+        Returns the buffered register updates, keyed on (origin pk, day),
+        and resets the buffer.
+        """
+        with self._lock:
+            updates, self._updates = self._updates, defaultdict(dict)
+            self._last_flush = time.time()
+        return updates
+
+    def flush(self):
+        updates = self.collect()
+        if not updates:
+            return
+        try:
+            with measure('visitor_flush'):
+                write_sketches(updates)
+        except Exception:
+            logger.exception("Could not write %d visitor sketches",
+                             len(updates))
+
+
+@transaction.commit_on_success
+def write_sketches(updates):
+    groups = dict(Origin.objects.filter(
+        pk__in=set(origin_pk for origin_pk, day in updates),
+        origin_group__isnull=False
+    ).values_list('pk', 'origin_group'))
+    group_updates = defaultdict(dict)
+    for (origin_pk, day), registers in updates.items():
+        if origin_pk in groups:
+            merged = group_updates[(groups[origin_pk], day)]
+            for index, rank in registers.items():
+                if rank > merged.get(index, 0):
+                    merged[index] = rank
+    merge_sketches(VisitorSketch, 'origin_id', updates)
+    merge_sketches(GroupVisitorSketch, 'origin_group_id', group_updates)
+
+
+def merge_sketches(model, key_field, updates):
+    """
+    Merges `updates`, register updates keyed on (pk, day), into the `model`
+    sketches with `key_field` set to that pk.
+    """
+    # a consistent order avoids deadlocks between concurrent flushes
+    for (pk, day), registers in sorted(updates.items()):
+        row, created = model.objects.select_for_update() \
+            .get_or_create(**{key_field: pk, 'day': day})
+        if created:
+            sketch = HyperLogLog(PRECISION)
+        else:
+            sketch = HyperLogLog.loads(row.registers, PRECISION)
+        for index, rank in registers.items():
+            sketch.update(index, rank)
+        row.registers = sketch.dumps()
+        row.save()
+
+
+def visitor_sketch(origins=None, group=None, since=None, until=None):
+    """
+    Returns the merged sketch of the visitors of `origins` (a list of pks)
+    or of the origins in `group`, on or after the day `since` and before the
+    day `until`.
+    """
+    if origins is None and group is not None:
+        sketches = reporting(GroupVisitorSketch.objects.filter(
+            origin_group=group))
+    else:
+        sketches = reporting(VisitorSketch.objects.all())
+        if origins is not None:
+            sketches = sketches.filter(origin__in=origins)
+        if group is not None:
+            sketches = sketches.filter(origin__origin_group=group)
+    if since is not None:
+        sketches = sketches.filter(day__gte=since)
+    if until is not None:
+        sketches = sketches.filter(day__lt=until)
+    merged = HyperLogLog(PRECISION)
+    for registers in sketches.values_list('registers', flat=True).iterator():
+        merged.merge(HyperLogLog.loads(registers, PRECISION))
+    return merged
+
+
+def unique_visitors(origins=None, group=None, since=None, until=None):
+    """
+    Returns the estimated number of distinct visitors, see `visitor_sketch`.
+    """
+    return visitor_sketch(origins, group, since, until).count()
+
+
+visitor_counter = VisitorCounter()
+# buffered updates are written before the process exits
+atexit.register(visitor_counter.flush)
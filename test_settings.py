@@ -26,7 +26,12 @@ DATABASES = {
         'PASSWORD': '',
         'HOST': '',
         'PORT': '',
-    }
+    },
+    # stands in for a read replica in the reporting tests
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'insight-replica.db',
+    },
 }
 
 # Local time zone for this installation. Choices can be found here:
@@ -119,6 +124,7 @@ INSTALLED_APPS = (
     'django.contrib.sessions',
     'django.contrib.sites',
     'django.contrib.messages',
+    'django.contrib.staticfiles',
     # Uncomment the next line to enable the admin:
     'django.contrib.admin',
     # Uncomment the next line to enable admin documentation: